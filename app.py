@@ -1,11 +1,28 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-from datetime import datetime, timedelta
-from decimal import Decimal
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import threading
+import time
 import snowflake.connector
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from snowflake.connector.constants import FIELD_ID_TO_NAME
+from snowflake.connector.errors import NotSupportedError
 import base64
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import zlib
 from pathlib import Path
+import numpy as np
+import pyarrow as pa
+from pyarrow import feather
 
 # ----------------------------
 # Page
@@ -720,6 +737,10 @@ ul[role="listbox"] li:focus,
 .rank-name {{
   font-weight: 500;
 }}
+.rank-sub {{
+  font-size: 0.8rem;
+  color: {COLORS["muted"]};
+}}
 .rank-val {{
   text-align:right;
   font-weight: 600;
@@ -813,10 +834,17 @@ def get_minigame_name(name):
     return MINIGAME_NAMES.get(name, name)
 
 # ----------------------------
-# Snowflake connection with auto-reconnect
+# Snowflake connection pool (keepalive + pre-emptive re-auth)
 # ----------------------------
-@st.cache_resource(ttl=2700)  # 45 minutes TTL (Snowflake tokens expire after ~1 hour)
-def get_connection():
+POOL_SIZE = 16                  # max concurrent warehouse connections per process
+POOL_MAX_AGE = 45 * 60          # re-authenticate before the ~1 hour token expiry
+POOL_REFRESH_EVERY = 60         # background check interval (seconds)
+POOL_IDLE_TIMEOUT = 10 * 60     # close connections unused this long instead of refreshing them
+POOL_ACQUIRE_TIMEOUT = 30       # seconds to wait for a free connection when the pool is full
+KEEPALIVE_HEARTBEAT = 900       # seconds between session heartbeats
+
+
+def _connect():
     return snowflake.connector.connect(
         user=st.secrets["snowflake"]["user"],
         password=st.secrets["snowflake"]["password"],
@@ -824,158 +852,2150 @@ def get_connection():
         warehouse=st.secrets["snowflake"]["warehouse"],
         database=st.secrets["snowflake"]["database"],
         schema=st.secrets["snowflake"]["schema"],
+        client_session_keep_alive=True,
+        client_session_keep_alive_heartbeat_frequency=KEEPALIVE_HEARTBEAT,
+        login_timeout=QUERY_TIMEOUT,
+        paramstyle="qmark",  # server-side bind variables, see bind_query()
     )
 
+
+def _is_token_expired(e: Exception) -> bool:
+    # Snowflake error code 390114
+    return "390114" in str(e) or "Authentication token has expired" in str(e)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class SnowflakePool:
+    """Bounded, thread-safe pool: every checkout gets its own connection.
+
+    Idle connections are re-created in the background once they get close to
+    POOL_MAX_AGE, so queries never hit an expired token in the first place;
+    connections nobody used for POOL_IDLE_TIMEOUT are closed instead.
+    """
+
+    def __init__(self, size: int, max_age: float):
+        self._size = size
+        self._max_age = max_age
+        self._idle = []  # [(conn, created_at, idle_since)]
+        self._open = 0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._refresh_loop, name="snowflake-pool-refresh", daemon=True).start()
+
+    @contextmanager
+    def connection(self):
+        conn, created_at = self._acquire()
+        discard = False
+        try:
+            yield conn
+        except snowflake.connector.errors.ProgrammingError as e:
+            discard = _is_token_expired(e)
+            raise
+        finally:
+            self._release(conn, created_at, discard)
+
+    def _acquire(self):
+        deadline = time.time() + POOL_ACQUIRE_TIMEOUT
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn, created_at, _ = self._idle.pop()
+                    if not conn.is_closed() and time.time() - created_at < self._max_age:
+                        return conn, created_at
+                    _close_quietly(conn)
+                    self._open -= 1
+                if self._open < self._size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    # A library error class, so the breaker counts it across reruns
+                    raise snowflake.connector.errors.OperationalError(
+                        msg=f"Bo'sh ulanish {POOL_ACQUIRE_TIMEOUT} soniyada topilmadi"
+                    )
+                self._cond.wait(remaining)
+        try:
+            return _connect(), time.time()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, conn, created_at, discard=False):
+        with self._cond:
+            if discard or conn.is_closed() or time.time() - created_at >= self._max_age:
+                _close_quietly(conn)
+                self._open -= 1
+            else:
+                self._idle.append((conn, created_at, time.time()))
+            self._cond.notify()
+
+    def _refresh_loop(self):
+        # Replace idle connections one refresh interval before they age out,
+        # unless they have not been used for a while: those are just closed
+        while True:
+            time.sleep(POOL_REFRESH_EVERY)
+            now = time.time()
+            aging = now - (self._max_age - 2 * POOL_REFRESH_EVERY)
+            unused = now - POOL_IDLE_TIMEOUT
+            with self._cond:
+                expired = [item for item in self._idle if item[2] < unused]
+                stale = [item for item in self._idle if item[2] >= unused and item[1] < aging]
+                self._idle = [item for item in self._idle if item[2] >= unused and item[1] >= aging]
+                self._open -= len(expired)
+                self._cond.notify(len(expired))
+            for conn, _, _ in expired:
+                _close_quietly(conn)
+            for conn, _, idle_since in stale:
+                _close_quietly(conn)
+                try:
+                    fresh = (_connect(), time.time(), idle_since)
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    continue
+                with self._cond:
+                    self._idle.append(fresh)
+                    self._cond.notify()
+
+
+@st.cache_resource
+def get_connection_pool() -> SnowflakePool:
+    return SnowflakePool(POOL_SIZE, POOL_MAX_AGE)
+
+# Snowflake DATE/TIMESTAMP type names (see snowflake.connector.constants.FIELD_TYPES)
+_DATETIME_TYPES = {"DATE", "TIMESTAMP_LTZ", "TIMESTAMP_NTZ", "TIMESTAMP_TZ"}
+
+
+def _coerce_columns(df: pd.DataFrame, description) -> pd.DataFrame:
+    """Cast each column once, based on the cursor's result metadata."""
+    for meta in description:
+        col = meta.name
+        type_name = FIELD_ID_TO_NAME[meta.type_code]
+        if type_name == "FIXED" and not meta.scale:
+            # NUMBER(p, 0) -> int64; NULLs force float so they stay NaN
+            df[col] = df[col].astype("float64" if df[col].isna().any() else "int64")
+        elif type_name in ("FIXED", "REAL"):
+            df[col] = df[col].astype("float64")
+        elif type_name in _DATETIME_TYPES:
+            df[col] = pd.to_datetime(df[col])
+        # TEXT/VARIANT/BOOLEAN are left untouched: version strings stay strings
+    return df
+
+
+# ----------------------------
+# Script-run tracking: abort warehouse queries a newer rerun made obsolete
+# ----------------------------
+class QueryCancelled(Exception):
+    """The script run that asked for this query was superseded."""
+
+    # Checked by attribute: the class object is re-created on every rerun
+    superseded = True
+
+
+class QueryTimeout(Exception):
+    """The warehouse did not answer within the query's timeout (see query_timeout())."""
+
+
+class WarehouseUnavailable(Exception):
+    """The circuit breaker is open; the warehouse is not being called."""
+
+
+class ScriptRun:
+    """Snowflake query ids started on behalf of one script run of one session."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.cancelled = False
+        self._sfqids = set()
+        self._flights = set()
+        self._lock = threading.Lock()
+
+    def register(self, sfqid: str) -> bool:
+        with self._lock:
+            if not self.cancelled:
+                self._sfqids.add(sfqid)
+                return True
+        return False
+
+    def unregister(self, sfqid: str):
+        with self._lock:
+            self._sfqids.discard(sfqid)
+
+    def join(self, flight):
+        with self._lock:
+            self._flights.add(flight)
+
+    def leave(self, flight):
+        with self._lock:
+            self._flights.discard(flight)
+
+    def cancel(self, successor=None, keep=frozenset()):
+        """Abort this run's queries, except shared executions of the query keys in
+        `keep`: the successor run asks for those again, so it takes them over."""
+        with self._lock:
+            self.cancelled = True
+            pending, self._sfqids = self._sfqids, set()
+            flights = list(self._flights)
+        for sfqid in pending:
+            _abort_query(sfqid)
+        # Shared executions are only aborted once every caller has gone away
+        for flight in flights:
+            if successor is not None and flight.key[0] in keep:
+                flight.add_caller(successor)
+                successor.join(flight)
+            else:
+                flight.abandon_if_orphaned()
+
+
+def _abort_query(sfqid: str):
+    # Server-side abort (same effect as SYSTEM$CANCEL_QUERY), best effort
+    try:
+        with get_connection_pool().connection() as conn:
+            conn.cursor().abort_query(sfqid)
+    except Exception:
+        pass
+
+
+@st.cache_resource
+def get_run_registry() -> dict:
+    # session_id -> latest ScriptRun
+    return {"lock": threading.Lock(), "runs": {}}
+
+
+def _session_is_active(session_id: str) -> bool:
+    return not runtime.exists() or runtime.get_instance().is_active_session(session_id)
+
+
+def begin_script_run(planned=()) -> ScriptRun:
+    """Make this rerun the session's current one and abort the previous run's
+    queries, except those whose query key is in `planned` (this run's plan).
+
+    Runs of sessions that have closed are dropped and their queries aborted.
+    """
+    ctx = get_script_run_ctx()
+    run = ScriptRun(ctx.session_id if ctx else "")
+    registry = get_run_registry()
+    with registry["lock"]:
+        previous = registry["runs"].get(run.session_id)
+        registry["runs"][run.session_id] = run
+        dead = [sid for sid in registry["runs"] if not _session_is_active(sid)]
+        orphans = [registry["runs"].pop(sid) for sid in dead if sid != run.session_id]
+    if previous is not None:
+        threading.Thread(
+            target=previous.cancel,
+            args=(run, frozenset(planned)),
+            name="cancel-stale-queries",
+            daemon=True,
+        ).start()
+    for orphan in orphans:
+        threading.Thread(target=orphan.cancel, name="cancel-stale-queries", daemon=True).start()
+    return run
+
+
+def end_script_run(run: ScriptRun):
+    registry = get_run_registry()
+    with registry["lock"]:
+        if registry["runs"].get(run.session_id) is run:
+            del registry["runs"][run.session_id]
+
+
+# Set per worker thread by submit_query: the ScriptRun the current query belongs to
+_query_context = threading.local()
+
+
+def _wait_for_query(conn, cur, sfqid: str, timeout: float):
+    deadline = time.time() + timeout
+    delay = 0.05
+    while conn.is_still_running(conn.get_query_status_throw_if_error(sfqid)):
+        if time.time() > deadline:
+            cur.abort_query(sfqid)
+            raise QueryTimeout(f"So'rov {int(timeout)} soniyada tugamadi")
+        time.sleep(delay)
+        delay = min(delay * 2, 0.5)
+
+
 # Remove "running query" popup - removed @st.cache_data spinner
-def _execute_query(query: str) -> pd.DataFrame:
-    """Execute query and return DataFrame."""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(query)
-    columns = [desc[0] for desc in cur.description]
-    data = cur.fetchall()
-    df = pd.DataFrame(data, columns=columns)
-
-    for col in df.columns:
-        if df[col].dtype == object:
-            if df[col].apply(lambda x: isinstance(x, Decimal)).any():
-                df[col] = df[col].apply(lambda x: float(x) if isinstance(x, Decimal) else x)
+def _execute_query(query: str, binds: list = None, timeout: float = None) -> pd.DataFrame:
+    """Execute query asynchronously and return DataFrame built from Arrow result batches."""
+    run = getattr(_query_context, "run", None)
+    if run is not None and run.cancelled:
+        raise QueryCancelled("Eskirgan so'rov bekor qilindi")
+    with get_connection_pool().connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute_async(query, binds)
+            sfqid = cur.sfqid
+            if run is not None and not run.register(sfqid):
+                cur.abort_query(sfqid)
+                raise QueryCancelled("Eskirgan so'rov bekor qilindi")
             try:
-                numeric_col = pd.to_numeric(df[col], errors="coerce")
-                if not numeric_col.isna().all():
-                    df[col] = numeric_col
-            except Exception:
-                pass
-    return df
+                _wait_for_query(conn, cur, sfqid, QUERY_TIMEOUT if timeout is None else timeout)
+            except snowflake.connector.errors.ProgrammingError as e:
+                if run is not None and run.cancelled:
+                    raise QueryCancelled("Eskirgan so'rov bekor qilindi") from e
+                raise
+            finally:
+                if run is not None:
+                    run.unregister(sfqid)
+            cur.get_results_from_sfqid(sfqid)
+            try:
+                # Arrow batches -> typed pandas columns, no per-row Python conversion
+                df = cur.fetch_pandas_all()
+            except NotSupportedError:
+                # Result did not come back in Arrow format (e.g. SHOW/DESC commands)
+                columns = [desc.name for desc in cur.description]
+                df = pd.DataFrame.from_records(cur.fetchall(), columns=columns)
+            return _coerce_columns(df, cur.description)
+        finally:
+            cur.close()
 
-# Performance boost - increased TTL and added show_spinner=False
-@st.cache_data(ttl=600, show_spinner=False)  # 10 minutes cache, no spinner
-def run_query(query: str) -> pd.DataFrame:
+# ----------------------------
+# Persistent result cache: second tier on local disk, shared by worker processes
+# ----------------------------
+RESULT_CACHE_DIR = Path(__file__).parent / ".cache" / "query_results"
+RESULT_CACHE_TTL = 24 * 3600                # safety net; freshness comes from watermarks
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024  # LRU eviction above this total size
+
+
+class DiskResultCache:
+    """Query results as zstd-compressed Arrow IPC files, keyed by query_key().
+
+    Entries expire after `ttl` seconds; the least recently read files are evicted
+    once the directory grows past `max_bytes`. A flock on `.lock` keeps several
+    Streamlit processes from evicting a file while another one writes or reads it.
+    """
+
+    def __init__(self, root: Path, ttl: float, max_bytes: int):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.root / ".lock"
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with open(self._lock_path, "a+") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{hashlib.sha256(key.encode()).hexdigest()}.arrow"
+
+    def has(self, key: str, max_age: float = None) -> bool:
+        """Whether get() would return the entry: it exists and is within max_age (default: ttl)."""
+        max_age = self.ttl if max_age is None else max_age
+        try:
+            # Reads only the IPC footer, not the data
+            with pa.ipc.open_file(self._path(key)) as reader:
+                stored_at = float(reader.schema.metadata[b"stored_at"])
+        except (OSError, pa.ArrowInvalid, KeyError, TypeError):
+            return False
+        return time.time() - stored_at <= max_age
+
+    def get(self, key: str, max_age: float = None):
+        """Stored DataFrame, or None if missing or older than max_age (default: ttl)."""
+        entry = self.get_entry(key, max_age)
+        return None if entry is None else entry[0]
+
+    def get_entry(self, key: str, max_age: float = None):
+        """(DataFrame, stored_at) or None."""
+        max_age = self.ttl if max_age is None else max_age
+        path = self._path(key)
+        with self._locked(exclusive=False):
+            try:
+                table = feather.read_table(path, memory_map=False)
+            except (OSError, pa.ArrowInvalid):
+                return None
+            stored_at = float(table.schema.metadata[b"stored_at"])
+            if time.time() - stored_at > max_age:
+                return None
+            os.utime(path)  # mtime doubles as "last read" for LRU eviction
+        return table.to_pandas(), stored_at
+
+    def put(self, key: str, df: pd.DataFrame):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"stored_at": str(time.time()).encode(),
+        })
+        path = self._path(key)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        try:
+            feather.write_feather(table, tmp, compression="zstd")
+            with self._locked(exclusive=True):
+                os.replace(tmp, path)
+                self._evict()
+        finally:
+            tmp.unlink(missing_ok=True)  # no-op once it has been moved into place
+
+    def _evict(self):
+        entries = []
+        for path in self.root.glob("*.arrow"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+@st.cache_resource
+def get_result_cache() -> DiskResultCache:
+    return DiskResultCache(RESULT_CACHE_DIR, RESULT_CACHE_TTL, RESULT_CACHE_MAX_BYTES)
+
+
+# ----------------------------
+# Circuit breaker: stop queueing up timeouts while the warehouse is down
+# ----------------------------
+QUERY_TIMEOUT = 60             # seconds per warehouse query, unless listed below
+QUERY_TIMEOUTS = {             # registry name prefix -> seconds
+    "rollup_": 15 * 60,        # first syncs pull all history
+    "hourly_activity": 5 * 60,
+}
+BREAKER_THRESHOLD = 3          # consecutive failures that open the breaker
+BREAKER_COOLDOWN = 60          # seconds before a single trial query is let through
+
+
+class CircuitBreaker:
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.time() - self._opened_at >= self.cooldown:
+                # Half-open: one trial per cooldown, the rest keep failing fast
+                self._opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened_at = time.time()
+
+
+@st.cache_resource
+def get_circuit_breaker() -> CircuitBreaker:
+    return CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+
+def query_timeout(name: str) -> float:
+    return next((seconds for prefix, seconds in QUERY_TIMEOUTS.items() if name.startswith(prefix)), QUERY_TIMEOUT)
+
+
+def _is_warehouse_failure(e: Exception) -> bool:
+    # SQL errors, cancellations and timeouts of slow but healthy queries say
+    # nothing about warehouse health
+    return isinstance(e, (
+        snowflake.connector.errors.OperationalError,
+        snowflake.connector.errors.InterfaceError,
+    ))
+
+
+def _execute_with_retry(query: str, binds: list = None, timeout: float = None) -> pd.DataFrame:
+    breaker = get_circuit_breaker()
+    if not breaker.allow():
+        raise WarehouseUnavailable("Ma'lumotlar ombori vaqtincha javob bermayapti")
     try:
-        return _execute_query(query)
-    except snowflake.connector.errors.ProgrammingError as e:
-        # Check if token expired (error code 390114)
-        if "390114" in str(e) or "Authentication token has expired" in str(e):
-            # Clear cached connection and retry
-            get_connection.clear()
-            return _execute_query(query)
+        try:
+            df = _execute_query(query, binds, timeout)
+        except snowflake.connector.errors.ProgrammingError as e:
+            # Safety net: the pool already dropped the expired connection, retry once
+            if not _is_token_expired(e):
+                raise
+            df = _execute_query(query, binds, timeout)
+    except Exception as e:
+        if _is_warehouse_failure(e):
+            breaker.record_failure()
         raise
+    breaker.record_success()
+    return df
+
+
+# ----------------------------
+# Data watermarks: cached results live until new data lands in their tables
+# ----------------------------
+WATERMARK_CHECK_EVERY = 300   # probe each table at most once per 5 minutes
+LATE_DATA_DAYS = 3            # days before a date counts as closed (late-arriving rows)
+CLOSED = "closed"
+
+# Cheap, partition-pruned probes (registry names): the latest date plus a token that moves with new rows
+WATERMARK_PROBES = {
+    "ACCOUNT_FACT_USER_SESSIONS_DAY": "watermark_sessions_day",
+    "ACCOUNT_EVENTS": "watermark_events",
+}
+
+
+@st.cache_data(ttl=WATERMARK_CHECK_EVERY, show_spinner=False)
+def table_watermark(table: str) -> tuple:
+    """(latest date, change token) for one source table."""
+    # Shared by every section and session, so not cancelled with the script run
+    run, _query_context.run = getattr(_query_context, "run", None), None
+    try:
+        df = _execute_with_retry(*bind_query(WATERMARK_PROBES[table], {"late": LATE_DATA_DAYS}))
+    finally:
+        _query_context.run = run
+    wm_date = df["WM_DATE"][0]
+    return (None if pd.isna(wm_date) else pd.Timestamp(wm_date).date()), str(df["WM_TOKEN"][0])
+
+
+def watermark_tag(name: str, until=None) -> str:
+    """Cache version for a registry query: changes only when one of its tables gets new data.
+
+    Queries whose date range ends (`until`) well before the watermark read closed
+    days that can no longer change, so they get a constant tag and are never re-run.
+    """
+    parts = []
+    for table in WATERMARK_PROBES:
+        if table not in QUERIES[name]:
+            continue
+        try:
+            wm_date, token = table_watermark(table)
+        except Exception:
+            # Probe failed: fall back to the old fixed 10-minute expiry
+            return f"t{int(time.time() // 600)}"
+        if until is not None and wm_date is not None and until < wm_date - timedelta(days=LATE_DATA_DAYS):
+            parts.append(f"{table}={CLOSED}")
+        else:
+            parts.append(f"{table}={token}")
+    return ";".join(parts)
+
+
+# Performance boost - show_spinner=False; entries are versioned by watermark tag
+@st.cache_data(ttl=RESULT_CACHE_TTL, max_entries=1000, show_spinner=False)
+def _cached_query(name: str, params: tuple, tag: str) -> pd.DataFrame:
+    # Memory miss: a restart or a sibling worker may already have the result on disk
+    disk = get_result_cache()
+    key = query_key(name, params)
+    disk_key = _disk_key(key, tag)
+    df = disk.get(disk_key, max_age=_tag_max_age(tag))
+    if df is not None:
+        return df
+    df = _execute_with_retry(*bind_query(name, params), timeout=query_timeout(name))
+    try:
+        disk.put(disk_key, df)
+        disk.put(key, df)  # untagged copy = last good result, for stale serving
+    except (OSError, pa.ArrowException, ValueError, TypeError):
+        pass  # disk tier is an optimisation only, e.g. mixed-type columns do not convert
+    return df
+
+
+def _disk_key(key: str, tag: str) -> str:
+    return f"{key}\n-- {tag}"
+
+
+def _tag_max_age(tag: str):
+    """Disk entry age limit for a watermark tag: closed ranges never expire."""
+    closed = bool(tag) and all(part.endswith(f"={CLOSED}") for part in tag.split(";"))
+    return float("inf") if closed else None
+
+
+# ----------------------------
+# Single-flight: concurrent callers of the same query share one execution
+# ----------------------------
+class QueryFlight:
+    """One in-flight execution and every script run waiting on it."""
+
+    def __init__(self, key: tuple):
+        self.key = key  # (query key, watermark tag)
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._runs = []  # None = caller outside a tracked script run
+        self._sfqids = set()
+        self._lock = threading.Lock()
+
+    def add_caller(self, run):
+        with self._lock:
+            self._runs.append(run)
+
+    @property
+    def cancelled(self) -> bool:
+        with self._lock:
+            return all(run is not None and run.cancelled for run in self._runs)
+
+    def register(self, sfqid: str) -> bool:
+        if self.cancelled:
+            return False
+        with self._lock:
+            self._sfqids.add(sfqid)
+        return True
+
+    def unregister(self, sfqid: str):
+        with self._lock:
+            self._sfqids.discard(sfqid)
+
+    def abandon_if_orphaned(self):
+        if not self.cancelled:
+            return
+        with self._lock:
+            pending, self._sfqids = self._sfqids, set()
+        for sfqid in pending:
+            _abort_query(sfqid)
+
+
+@st.cache_resource
+def get_inflight_queries() -> dict:
+    # (query key, watermark tag) -> QueryFlight
+    return {"lock": threading.Lock(), "flights": {}}
+
+
+def _shared_query(name: str, params: tuple, tag: str) -> pd.DataFrame:
+    """Cached query; identical concurrent requests wait on a single execution."""
+    key = (query_key(name, params), tag)
+    run = getattr(_query_context, "run", None)
+    inflight = get_inflight_queries()
+    with inflight["lock"]:
+        flight = inflight["flights"].get(key)
+        leader = flight is None
+        if leader:
+            flight = inflight["flights"][key] = QueryFlight(key)
+        flight.add_caller(run)
+    if run is not None:
+        run.join(flight)
+    try:
+        if leader:
+            # The warehouse query belongs to the flight, not to one script run
+            _query_context.run = flight
+            try:
+                flight.result = _cached_query(name, params, tag)
+            except BaseException as e:
+                flight.error = e
+            finally:
+                _query_context.run = run
+                with inflight["lock"]:
+                    inflight["flights"].pop(key, None)
+                flight.done.set()
+        else:
+            flight.done.wait()
+    finally:
+        if run is not None:
+            run.leave(flight)
+    if flight.error is not None:
+        if getattr(flight.error, "superseded", False) and not (run is not None and run.cancelled):
+            # The runs that started it were superseded, but this caller still needs it
+            return _shared_query(name, params, tag)
+        raise flight.error
+    return flight.result
+
+
+def _refresh_in_background(name: str, params: tuple, tag: str):
+    inflight = get_inflight_queries()
+    with inflight["lock"]:
+        if (query_key(name, params), tag) in inflight["flights"]:
+            return  # someone is already fetching it
+    # Not tied to any script run: the refresh completes even if the viewer moves on
+    submit_task(_shared_query, name, params, tag)
+
+
+def run_query(name: str, params: dict = None, until=None) -> pd.DataFrame:
+    """Registry query result through every cache tier, served stale-while-revalidate.
+
+    `until` is the last date the query reads; see watermark_tag(). When there is
+    no result for the current watermark yet, the last good one is returned at
+    once (with df.attrs["as_of"]) and refreshed in the background. Warehouse
+    errors, timeouts and an open circuit breaker also fall back to it.
+    """
+    params = normalize_params(name, params)
+    key = query_key(name, params)
+    tag = watermark_tag(name, until)
+    disk = get_result_cache()
+    if not disk.has(_disk_key(key, tag), max_age=_tag_max_age(tag)):
+        stale = disk.get_entry(key, max_age=float("inf"))
+        if stale is not None:
+            _refresh_in_background(name, params, tag)
+            return _as_of(*stale)
+    try:
+        return _shared_query(name, params, tag)
+    except Exception as e:
+        if getattr(e, "superseded", False):
+            raise
+        stale = disk.get_entry(key, max_age=float("inf"))
+        if stale is None:
+            raise
+        return _as_of(*stale)
+
+
+def _as_of(df: pd.DataFrame, stored_at: float) -> pd.DataFrame:
+    df.attrs["as_of"] = datetime.fromtimestamp(stored_at)
+    return df
+
+
+# ----------------------------
+# Concurrent section queries
+# ----------------------------
+@st.cache_resource
+def get_query_executor() -> ThreadPoolExecutor:
+    # One worker per pooled connection; extra submissions queue up
+    return ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="section-query")
+
+
+def submit_task(fn, *args, run: ScriptRun = None, **kwargs) -> Future:
+    """Run fn on the query executor on behalf of `run` (None = not cancellable)."""
+    ctx = get_script_run_ctx()
+
+    def task():
+        # st.cache_data needs the script run context of the page that asked
+        add_script_run_ctx(threading.current_thread(), ctx)
+        _query_context.run = run
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _query_context.run = None
+
+    return get_query_executor().submit(task)
+
+
+def submit_query(name: str, params: dict, run: ScriptRun) -> Future:
+    """Start run_query in the background; .result() blocks until it is ready."""
+    return submit_task(run_query, name, params, run=run)
+
+
+def show_as_of(*dfs):
+    """Caption for a section that is showing a stale result while it refreshes."""
+    stamps = [df.attrs["as_of"] for df in dfs if "as_of" in df.attrs]
+    if stamps:
+        st.caption(f"🕒 {min(stamps):%d.%m.%Y %H:%M} holatiga ko'ra · yangilanmoqda")
+
+
+def widget_value(key: str, default):
+    """Current value of a widget that is rendered further down the page."""
+    return st.session_state.get(key, default)
+
 
 GAME_ID = 181330318
 DB = "UNITY_ANALYTICS_GCP_US_CENTRAL1_UNITY_ANALYTICS_PDA.SHARES"
+RELEASE_DATE = datetime(2025, 12, 27).date()
 
+# ----------------------------
+# Local daily rollups: per-day metrics in SQLite, refreshed incrementally
+# ----------------------------
+ROLLUP_DB_PATH = Path(__file__).parent / ".cache" / "rollups.sqlite3"
+ROLLUP_SCHEMA_VERSION = 8        # bump on any schema change; the store is rebuilt from Snowflake
+HISTORY_START = date(1970, 1, 1)  # "since" for rollups that must cover all history
+LOCAL_UTC_OFFSET = timedelta(hours=5)  # dashboard hours are Tashkent time (UTC+5, no DST)
+
+ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        game_id INTEGER NOT NULL,
+        rollup TEXT NOT NULL,
+        last_date TEXT,
+        token TEXT NOT NULL,
+        synced_at REAL NOT NULL,
+        PRIMARY KEY (game_id, rollup)
+    );
+    CREATE TABLE IF NOT EXISTS daily_rollup (
+        game_id INTEGER NOT NULL,
+        event_date TEXT NOT NULL,
+        dau INTEGER NOT NULL,
+        sessions INTEGER NOT NULL,
+        total_time_ms INTEGER NOT NULL,
+        time_rows INTEGER NOT NULL,
+        PRIMARY KEY (game_id, event_date)
+    );
+    CREATE TABLE IF NOT EXISTS minigame_events (
+        game_id INTEGER NOT NULL,
+        event_date TEXT NOT NULL,
+        event_ts TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        session_id TEXT NOT NULL,
+        mini_game TEXT NOT NULL,
+        status TEXT NOT NULL,
+        PRIMARY KEY (game_id, event_ts, user_id, session_id, mini_game, status)
+    );
+    CREATE INDEX IF NOT EXISTS minigame_events_date ON minigame_events (game_id, event_date, mini_game);
+    CREATE TABLE IF NOT EXISTS minigame_daily (
+        game_id INTEGER NOT NULL,
+        event_date TEXT NOT NULL,
+        mini_game TEXT NOT NULL,
+        plays INTEGER NOT NULL,
+        players INTEGER NOT NULL,
+        PRIMARY KEY (game_id, event_date, mini_game)
+    );
+    CREATE TABLE IF NOT EXISTS user_ids (
+        game_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        PRIMARY KEY (game_id, user_id)
+    );
+    CREATE TABLE IF NOT EXISTS user_activity (
+        game_id INTEGER NOT NULL,
+        event_date TEXT NOT NULL,
+        bitmap BLOB NOT NULL,
+        PRIMARY KEY (game_id, event_date)
+    );
+    CREATE TABLE IF NOT EXISTS user_first_seen (
+        game_id INTEGER NOT NULL,
+        user_id TEXT NOT NULL,
+        first_date TEXT NOT NULL,
+        first_platform TEXT NOT NULL,
+        first_version TEXT NOT NULL,
+        PRIMARY KEY (game_id, user_id)
+    );
+    CREATE INDEX IF NOT EXISTS user_first_seen_date ON user_first_seen (game_id, first_date);
+    CREATE TABLE IF NOT EXISTS retention_cells (
+        game_id INTEGER NOT NULL,
+        grain TEXT NOT NULL,
+        cohort TEXT NOT NULL,
+        day_offset INTEGER NOT NULL,
+        cohort_users INTEGER NOT NULL,
+        returned INTEGER NOT NULL,
+        complete INTEGER NOT NULL,
+        PRIMARY KEY (game_id, grain, cohort, day_offset)
+    );
+    CREATE TABLE IF NOT EXISTS hourly_activity (
+        game_id INTEGER NOT NULL,
+        local_date TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        events INTEGER NOT NULL,
+        users INTEGER NOT NULL,
+        PRIMARY KEY (game_id, local_date, hour)
+    );
+    CREATE TABLE IF NOT EXISTS user_hll (
+        game_id INTEGER NOT NULL,
+        event_date TEXT NOT NULL,
+        platform TEXT NOT NULL,
+        client_version TEXT NOT NULL,
+        registers BLOB NOT NULL,
+        PRIMARY KEY (game_id, event_date, platform, client_version)
+    );
+"""
+
+# Rollup -> source table (for its watermark), registry query, local table, result
+# columns in insert order, first date pulled, per-column conversions, and for
+# tables keyed by user rather than date an "upsert" that merges the pulled rows;
+# an "insert" replaces the plain INSERT of the re-pulled days, and "refresh"
+# statements rebuild derived tables from :start on in the same transaction
+ROLLUPS = {
+    "daily": {
+        "source": "ACCOUNT_FACT_USER_SESSIONS_DAY",
+        "query": "rollup_daily",
+        "table": "daily_rollup",
+        "columns": ["SANA", "DAU", "SESSIYALAR", "TOTAL_TIME_MS", "TIME_ROWS"],
+        "since": RELEASE_DATE,
+    },
+    # playedMiniGameStatus events with EVENT_JSON parsed once, at extraction;
+    # from the release, like the mini-game date picker, so the all-time game
+    # list and top-5 leave out pre-release test traffic. The source has no event
+    # id, so exact duplicates (same millisecond, user, session, game, status)
+    # are stored once
+    "minigame_events": {
+        "source": "ACCOUNT_EVENTS",
+        "query": "rollup_minigame_events",
+        "table": "minigame_events",
+        "columns": ["SANA", "EVENT_TS", "USER_ID", "SESSION_ID", "MINI_GAME", "STATUS"],
+        "since": RELEASE_DATE,
+        "insert": "INSERT OR IGNORE INTO minigame_events VALUES (?, ?, ?, ?, ?, ?, ?)",
+        # Per-day plays and players per game, and over all games as '*' (distinct
+        # players do not add up across games), for the re-pulled days only
+        "refresh": (
+            "DELETE FROM minigame_daily WHERE game_id = :game_id AND event_date >= :start",
+            """
+            INSERT INTO minigame_daily
+            SELECT game_id, event_date, mini_game, COUNT(*), COUNT(DISTINCT user_id)
+            FROM minigame_events
+            WHERE game_id = :game_id AND event_date >= :start
+            GROUP BY event_date, mini_game
+            UNION ALL
+            SELECT game_id, event_date, '*', COUNT(*), COUNT(DISTINCT user_id)
+            FROM minigame_events
+            WHERE game_id = :game_id AND event_date >= :start
+            GROUP BY event_date
+            """,
+        ),
+    },
+    "activity": {
+        "source": "ACCOUNT_FACT_USER_SESSIONS_DAY",
+        "query": "rollup_activity",
+        "table": "user_activity",
+        "columns": ["SANA", "USER_ID"],
+        "since": HISTORY_START,  # retention cohorts reach back before the release
+        "build": lambda db, df: _build_activity(db, df),
+    },
+    # One row per user; SANA is the user's last day in the pulled window
+    "first_seen": {
+        "source": "ACCOUNT_FACT_USER_SESSIONS_DAY",
+        "query": "rollup_first_seen",
+        "table": "user_first_seen",
+        "columns": ["SANA", "USER_ID", "FIRST_DATE", "FIRST_PLATFORM", "FIRST_VERSION"],
+        "since": HISTORY_START,
+        "convert": {"USER_ID": str, "FIRST_DATE": lambda day: pd.Timestamp(day).strftime("%Y-%m-%d")},
+        "build": lambda db, df: _build_first_seen(db, df),
+        "upsert": """
+            INSERT INTO user_first_seen VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (game_id, user_id) DO UPDATE SET
+                first_date = excluded.first_date,
+                first_platform = excluded.first_platform,
+                first_version = excluded.first_version
+            WHERE excluded.first_date < user_first_seen.first_date
+        """,
+    },
+    # All history: total and platform users have never been limited to the release
+    "user_hll": {
+        "source": "ACCOUNT_FACT_USER_SESSIONS_DAY",
+        "query": "rollup_user_hll",
+        "table": "user_hll",
+        "columns": ["SANA", "PLATFORM", "CLIENT_VERSION", "SKETCH"],
+        "since": HISTORY_START,
+        "prepare": lambda df: _prepare_hll(df),
+    },
+    # Keyed by local hour, not by date: see RollupStore.sync_hours()
+    "hourly": {
+        "source": "ACCOUNT_EVENTS",
+        "query": "hourly_activity",
+        "table": "hourly_activity",
+        "since": RELEASE_DATE,
+        "hourly": True,
+    },
+}
 
-# Get current timestamp for last update
-last_update_date = "15.01.2026"
-try:
-    last_ver_df = run_query(f"""
-        SELECT COALESCE(CLIENT_VERSION, 'Noma''lum') AS LAST_UPDATE_VERSION
-        FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-          AND CLIENT_VERSION IS NOT NULL
-        QUALIFY ROW_NUMBER() OVER (ORDER BY EVENT_DATE DESC) = 1
-    """)
-    last_update_version = last_ver_df["LAST_UPDATE_VERSION"][0] if not last_ver_df.empty else "N/A"
-except Exception:
-    last_update_version = "N/A"
 
+def local_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None) + LOCAL_UTC_OFFSET
 
 
+def closed_hours_end(loaded_until: datetime) -> datetime:
+    """Local start of the first hour that is not closed yet.
 
-st.markdown(f'''
-<div class="header">
-    <img src="data:image/png;base64,{LOGO_BASE64}" style="height:60px;width:auto;" />
-</div>
-''', unsafe_allow_html=True)
+    Stored hours are never re-read, so an hour closes only once it is older
+    than the late-data window, like a closed date, and the events table has
+    loaded past its end (the UTC `loaded_until` watermark).
+    """
+    end = min(local_now() - timedelta(days=LATE_DATA_DAYS), loaded_until + LOCAL_UTC_OFFSET)
+    return end.replace(minute=0, second=0, microsecond=0)
+
+
+class RollupStore:
+    """Per-day rollups of the session and event tables in a local SQLite file.
+
+    `rollup_state` keeps, per rollup, the last date pulled and the
+    watermark token it was pulled at. When the token moves, only the days from
+    `last_date - LATE_DATA_DAYS` on are re-read and replaced, so warehouse cost
+    grows with new days rather than with history. WAL mode lets other worker
+    processes keep reading while one of them refreshes.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()  # derived writes, see write()
+        # One lock per rollup, so different rollups pull from the warehouse in
+        # parallel; their SQLite writes are serialized by BEGIN IMMEDIATE
+        self._sync_locks = {rollup: threading.Lock() for rollup in ROLLUPS}
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            if db.execute("PRAGMA user_version").fetchone()[0] != ROLLUP_SCHEMA_VERSION:
+                # Only derived data lives here: drop it and let the next sync rebuild it
+                tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+                for (table,) in tables:
+                    db.execute(f"DROP TABLE IF EXISTS {table}")
+                db.execute(f"PRAGMA user_version = {ROLLUP_SCHEMA_VERSION}")
+            db.executescript(ROLLUP_SCHEMA)
+
+    @contextmanager
+    def _db(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def state(self, rollup: str):
+        """(last_date, token, synced_at) for a rollup, or None before the first sync."""
+        with self._db() as db:
+            return db.execute(
+                "SELECT last_date, token, synced_at FROM rollup_state WHERE game_id = ? AND rollup = ?",
+                (GAME_ID, rollup),
+            ).fetchone()
+
+    def sync(self, rollup: str):
+        """Pull the days that changed since the last sync, if the watermark moved."""
+        spec = ROLLUPS[rollup]
+        if spec.get("hourly"):
+            return self.sync_hours(rollup)
+        _, token = table_watermark(spec["source"])
+        state = self.state(rollup)
+        if state is not None and state[1] == token:
+            return
+        with self._sync_locks[rollup]:
+            state = self.state(rollup)
+            if state is not None and state[1] == token:
+                return  # another section synced it while we waited
+            start = spec["since"]
+            if state is not None and state[0] is not None:
+                start = max(start, date.fromisoformat(state[0]) - timedelta(days=LATE_DATA_DAYS))
+            table, columns = spec["table"], spec["columns"]
+            run, _query_context.run = getattr(_query_context, "run", None), None
+            try:
+                # Shared by every section, so not cancelled with the script run
+                df = _execute_with_retry(
+                    *bind_query(spec["query"], {"date_from": start}),
+                    timeout=query_timeout(spec["query"]),
+                )
+            finally:
+                _query_context.run = run
+            if "prepare" in spec:
+                df = spec["prepare"](df)  # whole-batch checks and conversions
+            df = df[columns].copy()
+            df["SANA"] = pd.to_datetime(df["SANA"]).dt.strftime("%Y-%m-%d")
+            for column, convert in spec.get("convert", {}).items():
+                df[column] = df[column].map(convert)
+            last_date = df["SANA"].max() if not df.empty else (state[0] if state is not None else None)
+            with self._db() as db:
+                db.execute("BEGIN IMMEDIATE")
+                if "build" in spec:
+                    rows = spec["build"](db, df)  # may need the store itself, e.g. for id mapping
+                else:
+                    rows = [(GAME_ID, *row) for row in df.itertuples(index=False)]
+                if "upsert" in spec:
+                    db.executemany(spec["upsert"], [(GAME_ID, *row[2:]) for row in rows])  # drop SANA
+                else:
+                    db.execute(f"DELETE FROM {table} WHERE game_id = ? AND event_date >= ?", (GAME_ID, start.isoformat()))
+                    if rows:
+                        insert = spec.get("insert", f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})")
+                        db.executemany(insert, rows)
+                for sql in spec.get("refresh", ()):
+                    db.execute(sql, {"game_id": GAME_ID, "start": start.isoformat()})
+                db.execute(
+                    "INSERT OR REPLACE INTO rollup_state VALUES (?, ?, ?, ?, ?)",
+                    (GAME_ID, rollup, last_date, token, time.time()),
+                )
+                db.commit()
+
+    def sync_hours(self, rollup: str):
+        """Pull the local hours closed since the last sync, each exactly once.
+
+        `last_date` holds the local start of the first hour not stored yet; the
+        warehouse is read over the half-open UTC range up to the latest closed
+        hour, so the timestamp column is compared as is and prunes partitions.
+        """
+        spec = ROLLUPS[rollup]
+        loaded_until = pd.to_datetime(table_watermark(spec["source"])[1], errors="coerce", utc=True)
+        if pd.isna(loaded_until):
+            return  # no recent events loaded: no hour can be called closed
+        closed_until = closed_hours_end(loaded_until.tz_localize(None).to_pydatetime())
+        state = self.state(rollup)
+        if state is not None and state[0] >= closed_until.isoformat():
+            return
+        with self._sync_locks[rollup]:
+            state = self.state(rollup)
+            if state is not None:
+                start = datetime.fromisoformat(state[0])
+            else:
+                start = datetime.combine(spec["since"], datetime.min.time())
+            if start >= closed_until:
+                return
+            run, _query_context.run = getattr(_query_context, "run", None), None
+            try:
+                df = _execute_with_retry(*bind_query(spec["query"], {
+                    "utc_from": start - LOCAL_UTC_OFFSET,
+                    "utc_to": closed_until - LOCAL_UTC_OFFSET,
+                }), timeout=query_timeout(spec["query"]))
+            finally:
+                _query_context.run = run
+            hours = pd.to_datetime(df["SOAT_BOSHI"])
+            rows = list(zip(
+                [GAME_ID] * len(df),
+                hours.dt.strftime("%Y-%m-%d").tolist(),
+                hours.dt.hour.tolist(),
+                df["HODISALAR"].astype("int64").tolist(),
+                df["FOYDALANUVCHILAR"].astype("int64").tolist(),
+            ))
+            with self._db() as db:
+                db.execute("BEGIN IMMEDIATE")
+                db.executemany(f"INSERT OR REPLACE INTO {spec['table']} VALUES (?, ?, ?, ?, ?)", rows)
+                db.execute(
+                    "INSERT OR REPLACE INTO rollup_state VALUES (?, ?, ?, ?, ?)",
+                    (GAME_ID, rollup, closed_until.isoformat(), closed_until.isoformat(), time.time()),
+                )
+                db.commit()
+
+    def ensure(self, rollup: str):
+        """Sync if possible. Returns None when fresh, or the last sync time when the
+        warehouse is unreachable and the stored rows are served as they are."""
+        try:
+            self.sync(rollup)
+        except Exception as e:
+            state = self.state(rollup)
+            if getattr(e, "superseded", False) or state is None:
+                raise
+            return state[2]
+        return None
+
+    def query(self, sql: str, params: dict) -> list:
+        with self._db() as db:
+            return db.execute(sql, {"game_id": GAME_ID, **params}).fetchall()
+
+    def write(self, sql: str, rows: list):
+        """Write derived rows; serialized with other writer threads."""
+        with self._lock, self._db() as db:
+            db.executemany(sql, rows)
+            db.commit()
+
+    def frame(self, rollup: str, sql: str, params: dict) -> pd.DataFrame:
+        """Read rollups after syncing; if the warehouse is unreachable, serve what is stored."""
+        stale_at = self.ensure(rollup)
+        with self._db() as db:
+            df = pd.read_sql_query(sql, db, params={"game_id": GAME_ID, **params})
+        return df if stale_at is None else _as_of(df, stale_at)
+
+
+@st.cache_resource
+def get_rollup_store() -> RollupStore:
+    return RollupStore(ROLLUP_DB_PATH)
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _daily_frame(synced_at: float) -> pd.DataFrame:
+    """The whole per-day series since the release, for one version of the store."""
+    rows = get_rollup_store().query("""
+        SELECT
+            event_date,
+            dau,
+            sessions,
+            ROUND(total_time_ms * 1.0 / NULLIF(time_rows, 0) / 60000, 1)
+        FROM daily_rollup
+        WHERE game_id = :game_id
+        ORDER BY event_date
+    """, {})
+    df = pd.DataFrame(rows, columns=["SANA", "DAU", "SESSIYALAR", "ORTACHA_DAVOMIYLIK"])
+    df["SANA"] = pd.to_datetime(df["SANA"])
+    return df
+
+
+def daily_activity(date_from, date_to) -> pd.DataFrame:
+    """Slice of the shared daily frame (SANA, DAU, SESSIYALAR, ORTACHA_DAVOMIYLIK).
+
+    Every preset period of the sessions and DAU sections, and the sessions KPI,
+    is a window of the same cached frame, so changing a period never queries.
+    """
+    store = get_rollup_store()
+    stale_at = store.ensure("daily")
+    df = _daily_frame(store.state("daily")[2])
+    df = df[(df["SANA"] >= pd.Timestamp(date_from)) & (df["SANA"] <= pd.Timestamp(date_to))].reset_index(drop=True)
+    return _with_as_of(df, stale_at)
+
+
+def daily_sessions(date_from, date_to) -> pd.DataFrame:
+    df = daily_activity(date_from, date_to)
+    return df[df["SESSIYALAR"] > 0].reset_index(drop=True)
+
+
+def hourly_activity(day) -> pd.DataFrame:
+    """Events and distinct users per hour of one local (UTC+5) day.
+
+    Closed hours are read from the store. The hours still inside the late-data
+    window go to the warehouse, over their half-open range, cached until new
+    events land.
+    """
+    store = get_rollup_store()
+    stale_at = store.ensure("hourly")
+    state = store.state("hourly")
+    rows = store.query("""
+        SELECT hour, events, users FROM hourly_activity
+        WHERE game_id = :game_id AND local_date = :day
+        ORDER BY hour
+    """, {"day": str(day)})
+    df = pd.DataFrame(rows, columns=["SOAT", "HODISALAR", "FOYDALANUVCHILAR"])
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    open_from = day_start if state is None else max(day_start, datetime.fromisoformat(state[0]))
+    if open_from < day_end and stale_at is None:
+        try:
+            live = run_query("hourly_activity", {
+                "utc_from": open_from - LOCAL_UTC_OFFSET,
+                "utc_to": day_end - LOCAL_UTC_OFFSET,
+            }, until=day)
+        except Exception as e:
+            if getattr(e, "superseded", False) or state is None:
+                raise
+            stale_at = state[2]
+        else:
+            live = pd.DataFrame({
+                "SOAT": pd.to_datetime(live["SOAT_BOSHI"]).dt.hour,
+                "HODISALAR": live["HODISALAR"],
+                "FOYDALANUVCHILAR": live["FOYDALANUVCHILAR"],
+            })
+            df = pd.concat([df, live], ignore_index=True).sort_values("SOAT", ignore_index=True)
+    return _with_as_of(df, stale_at)
+
+
+WEEKDAYS = ["Dushanba", "Seshanba", "Chorshanba", "Payshanba", "Juma", "Shanba", "Yakshanba"]
+
+
+def hourly_heatmap(date_from, date_to) -> pd.DataFrame:
+    """Average events and active users per local weekday x hour over the
+    closed hours of [date_from, date_to], from one grouping of the hourly rollup.
+
+    Each cell is averaged over the stored hours it covers, so a range reaching
+    before the release or into hours not closed yet is not diluted.
+    """
+    store = get_rollup_store()
+    stale_at = store.ensure("hourly")
+    state = store.state("hourly")
+    rows = store.query("""
+        SELECT
+            (CAST(strftime('%w', local_date) AS INTEGER) + 6) % 7 AS weekday,
+            hour,
+            SUM(events),
+            SUM(users)
+        FROM hourly_activity
+        WHERE game_id = :game_id AND local_date BETWEEN :date_from AND :date_to
+        GROUP BY weekday, hour
+    """, {"date_from": str(date_from), "date_to": str(date_to)})
+    grid = pd.MultiIndex.from_product([range(7), range(24)], names=["HAFTA_KUNI", "SOAT"])
+    df = (
+        pd.DataFrame(rows, columns=["HAFTA_KUNI", "SOAT", "HODISALAR", "FOYDALANUVCHILAR"])
+        .set_index(["HAFTA_KUNI", "SOAT"])
+        .reindex(grid, fill_value=0)
+        .astype("int64")
+        .reset_index()
+    )
+    # Hours without events have no row, so count the stored hours themselves: the
+    # store holds every hour from the release up to the first one not closed yet
+    stored = pd.date_range(
+        max(pd.Timestamp(date_from), pd.Timestamp(ROLLUPS["hourly"]["since"])),
+        min(pd.Timestamp(date_to) + pd.Timedelta(days=1), pd.Timestamp(state[0] if state is not None else date_from)),
+        freq="h",
+        inclusive="left",
+    )
+    hours = pd.DataFrame({"HAFTA_KUNI": stored.weekday, "SOAT": stored.hour}).value_counts()
+    per_hour = pd.Series(hours.reindex(grid, fill_value=0).to_numpy()).where(lambda n: n > 0)
+    df["HODISALAR"] = (df["HODISALAR"] / per_hour).round(1)
+    df["FOYDALANUVCHILAR"] = (df["FOYDALANUVCHILAR"] / per_hour).round(1)
+    df["KUN"] = df["HAFTA_KUNI"].map(dict(enumerate(WEEKDAYS)))
+    df["SOAT_LABEL"] = df["SOAT"].map(lambda hour: f"{hour:02d}:00")
+    return _with_as_of(df, stale_at)
+
+
+# New-users period -> bucket start; "W-SUN" periods run Monday..Sunday like DATE_TRUNC('week')
+NEW_USERS_PERIODS = {"Kunlik": "D", "Haftalik": "W-SUN", "Oylik": "M"}
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _new_users_daily(synced_at: float) -> pd.Series:
+    """New users per first-seen day over all history, for one version of the store."""
+    rows = get_rollup_store().query("""
+        SELECT first_date, COUNT(*) FROM user_first_seen
+        WHERE game_id = :game_id
+        GROUP BY first_date
+        ORDER BY first_date
+    """, {})
+    return pd.Series(
+        [count for _, count in rows],
+        index=pd.DatetimeIndex([day for day, _ in rows]),
+        dtype="int64",
+    )
+
+
+def first_seen_new_users(period: str, date_from, date_to) -> pd.DataFrame:
+    """New users per day/week/month for first-seen dates in [date_from, date_to).
+
+    The daily series is loaded once per store version; switching period or
+    range only slices and resamples it in memory.
+    """
+    store = get_rollup_store()
+    stale_at = store.ensure("first_seen")
+    daily = _new_users_daily(store.state("first_seen")[2])
+    window = daily[(daily.index >= pd.Timestamp(date_from)) & (daily.index < pd.Timestamp(date_to))]
+    buckets = window.groupby(window.index.to_period(NEW_USERS_PERIODS[period]).start_time).sum()
+    df = pd.DataFrame({"SANA": buckets.index, "YANGI_USERS": buckets.to_numpy()})
+    return _with_as_of(df, stale_at)
+
+
+def first_seen_total_users() -> pd.DataFrame:
+    return get_rollup_store().frame("first_seen", """
+        SELECT COUNT(*) AS TOTAL FROM user_first_seen WHERE game_id = :game_id
+    """, {})
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def _minigame_cube(synced_at: float) -> pd.DataFrame:
+    """(date, mini-game) -> plays and players, for one version of the store.
+
+    Rows with MINI_GAME None are the per-day totals over all games, as
+    distinct players do not add up across games.
+    """
+    rows = get_rollup_store().query("""
+        SELECT event_date, NULLIF(mini_game, '*'), plays, players
+        FROM minigame_daily
+        WHERE game_id = :game_id
+        ORDER BY event_date
+    """, {})
+    df = pd.DataFrame(rows, columns=["SANA", "MINI_GAME", "OYINLAR", "OYINCHILAR"])
+    df["SANA"] = pd.to_datetime(df["SANA"])
+    return df
+
+
+def minigame_cube(date_from=None, date_to=None) -> pd.DataFrame:
+    """Cube rows for [date_from, date_to], all history when a bound is None.
+
+    The game list and every game's trend are slices of the same cached cube,
+    so switching games or ranges never queries.
+    """
+    store = get_rollup_store()
+    stale_at = store.ensure("minigame_events")
+    df = _minigame_cube(store.state("minigame_events")[2])
+    if date_from is not None:
+        df = df[df["SANA"] >= pd.Timestamp(date_from)]
+    if date_to is not None:
+        df = df[df["SANA"] <= pd.Timestamp(date_to)]
+    return _with_as_of(df.reset_index(drop=True), stale_at)
+
+
+def minigame_list() -> pd.DataFrame:
+    cube = minigame_cube()
+    games = cube.loc[cube["MINI_GAME"].notna() & (cube["MINI_GAME"] != ""), "MINI_GAME"]
+    df = pd.DataFrame({"MINI_GAME": sorted(games.unique())})
+    df.attrs.update(cube.attrs)
+    return df
+
+
+def minigame_plays(date_from, date_to, mini_game: str = None) -> pd.DataFrame:
+    """Mini-game plays and players per day; all games when mini_game is None."""
+    cube = minigame_cube(date_from, date_to)
+    rows = cube["MINI_GAME"].isna() if mini_game is None else cube["MINI_GAME"] == mini_game
+    df = cube.loc[rows, ["SANA", "OYINLAR", "OYINCHILAR"]].reset_index(drop=True)
+    df.attrs.update(cube.attrs)
+    return df
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _minigame_depth(synced_at: float, date_from: str, date_to: str) -> pd.DataFrame:
+    """Per-game players, plays, plays per player and its p50/p90, from one
+    (game, user) grouping of the local events."""
+    rows = get_rollup_store().query("""
+        SELECT mini_game, COUNT(*)
+        FROM minigame_events
+        WHERE game_id = :game_id AND mini_game != ''
+          AND (:date_from IS NULL OR event_date >= :date_from)
+          AND (:date_to IS NULL OR event_date <= :date_to)
+        GROUP BY mini_game, user_id
+    """, {"date_from": date_from, "date_to": date_to})
+    plays = pd.DataFrame(rows, columns=["MINI_GAME", "OYINLAR"]).groupby("MINI_GAME")["OYINLAR"]
+    df = pd.DataFrame({
+        "OYINCHILAR": plays.size(),
+        "OYINLAR": plays.sum(),
+        "P50": plays.quantile(0.5),
+        "P90": plays.quantile(0.9),
+    }).rename_axis("MINI_GAME").reset_index()
+    df["OYIN_PER_OYINCHI"] = (df["OYINLAR"] / df["OYINCHILAR"]).round(1)
+    return df
+
+
+def minigame_depth(date_from=None, date_to=None) -> pd.DataFrame:
+    """Engagement depth per game in the range (all time without bounds)."""
+    store = get_rollup_store()
+    stale_at = store.ensure("minigame_events")
+    df = _minigame_depth(
+        store.state("minigame_events")[2],
+        None if date_from is None else str(date_from),
+        None if date_to is None else str(date_to),
+    )
+    return _with_as_of(df, stale_at)
+
+
+def minigame_top(date_from=None, date_to=None, limit: int = 5) -> pd.DataFrame:
+    """Mini-games with the most distinct players in the range, so replays by
+    a few users do not outrank games many children tried."""
+    df = minigame_depth(date_from, date_to)
+    top = df.sort_values(["OYINCHILAR", "OYINLAR"], ascending=False).head(limit).reset_index(drop=True)
+    top.attrs.update(df.attrs)
+    return top
+
+
+# EVENT_JSON:Status values that open and finish one attempt at a mini-game. Other
+# statuses are not read: a start with no completion after it counts as abandoned
+MINIGAME_STARTED = "Started"
+MINIGAME_COMPLETED = "Completed"
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _minigame_funnel(synced_at: float, date_from: str, date_to: str) -> pd.DataFrame:
+    """Starts, completions and median seconds to complete per mini-game, in one
+    pass over the local events.
+
+    A completion belongs to the latest start of the same game by the same user
+    in the same session, and only the first one after a start in the range
+    counts, so conversion never exceeds 100%. Raises if the range has events
+    but none with either status, i.e. the status values are not the ones sent.
+    """
+    store = get_rollup_store()
+    params = {"date_from": date_from, "date_to": date_to, "started": MINIGAME_STARTED, "completed": MINIGAME_COMPLETED}
+    rows = store.query("""
+        WITH attempts AS (
+            SELECT
+                mini_game,
+                status,
+                event_ts,
+                MAX(CASE WHEN status = :started THEN event_ts END) OVER (
+                    PARTITION BY user_id, session_id, mini_game
+                    ORDER BY event_ts
+                    ROWS UNBOUNDED PRECEDING
+                ) AS started_ts,
+                user_id,
+                session_id
+            FROM minigame_events
+            WHERE game_id = :game_id AND event_date BETWEEN :date_from AND :date_to
+              AND mini_game != '' AND status IN (:started, :completed)
+        ), ranked AS (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY user_id, session_id, mini_game, started_ts, status
+                ORDER BY event_ts
+            ) AS nth
+            FROM attempts
+        )
+        SELECT mini_game, status, (julianday(event_ts) - julianday(started_ts)) * 86400
+        FROM ranked
+        WHERE status = :started OR (started_ts IS NOT NULL AND nth = 1)
+    """, params)
+    if not rows:
+        seen = [status for (status,) in store.query("""
+            SELECT DISTINCT status FROM minigame_events
+            WHERE game_id = :game_id AND event_date BETWEEN :date_from AND :date_to AND mini_game != ''
+            LIMIT 10
+        """, params)]
+        if seen:
+            raise ValueError(
+                f"'{MINIGAME_STARTED}' / '{MINIGAME_COMPLETED}' statuslari topilmadi, mavjudlari: {', '.join(map(repr, seen))}"
+            )
+    df = pd.DataFrame(rows, columns=["MINI_GAME", "STATUS", "SEKUND"])
+    completed = df["STATUS"] == MINIGAME_COMPLETED
+    funnel = pd.DataFrame({
+        "BOSHLANGAN": (~completed).groupby(df["MINI_GAME"]).sum(),
+        "TUGATILGAN": completed.groupby(df["MINI_GAME"]).sum(),
+        "MEDIAN_SEKUND": df.loc[completed, "SEKUND"].groupby(df.loc[completed, "MINI_GAME"]).median(),
+    }).fillna({"BOSHLANGAN": 0, "TUGATILGAN": 0})
+    funnel[["BOSHLANGAN", "TUGATILGAN"]] = funnel[["BOSHLANGAN", "TUGATILGAN"]].astype("int64")
+    funnel["TASHLANGAN"] = (funnel["BOSHLANGAN"] - funnel["TUGATILGAN"]).clip(lower=0)
+    funnel["KONVERSIYA"] = (funnel["TUGATILGAN"] * 100 / funnel["BOSHLANGAN"].where(funnel["BOSHLANGAN"] > 0)).round(1)
+    funnel = funnel.rename_axis("MINI_GAME").reset_index()
+    return funnel.sort_values("BOSHLANGAN", ascending=False, ignore_index=True)
+
+
+def minigame_funnel(date_from, date_to) -> pd.DataFrame:
+    """Per-game completion funnel for the range, cached per store version."""
+    store = get_rollup_store()
+    stale_at = store.ensure("minigame_events")
+    df = _minigame_funnel(store.state("minigame_events")[2], str(date_from), str(date_to))
+    return _with_as_of(df, stale_at)
 
 
 # ----------------------------
-# KPI (4 cards) - TASK 6: Load in parallel for better performance
+# HyperLogLog sketches: distinct users over any date range by merging daily sketches
 # ----------------------------
-# Load KPIs with minimal queries
-try:
-    total_users = run_query(f"""
-        SELECT COUNT(DISTINCT USER_ID) as TOTAL
-        FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-    """)
-    kpi_total_users = int(total_users["TOTAL"][0])
-except Exception:
-    kpi_total_users = None
+HLL_PRECISION = 12                    # Snowflake's HLL_ACCUMULATE precision
+HLL_REGISTERS = 1 << HLL_PRECISION    # 4096 registers, standard error 1.04 / sqrt(4096) ≈ 1.6%
+HLL_CHECK_ROWS = 20                   # sketches per sync compared against HLL_ESTIMATE
+HLL_CHECK_TOLERANCE = 0.1             # median relative difference allowed (an off-by-one is ~2x)
 
-# Defaults for initial view
-default_start = datetime.now() - timedelta(days=30)
-default_end = datetime.now()
 
-# DAU - Daily Active Users (yesterday, as today may be incomplete)
-try:
-    yesterday = datetime.now() - timedelta(days=1)
-    dau_df = run_query(f"""
-        SELECT COUNT(DISTINCT USER_ID) as DAU
+def hll_registers(sketch, rank_offset: int = 0) -> np.ndarray:
+    """Dense register array from an HLL_EXPORT object (sparse or dense form).
+
+    `rank_offset` is added to every exported count to turn it into an HLL
+    register value (rank of the first 1 bit); _prepare_hll() picks it by
+    checking the result against Snowflake's own HLL_ESTIMATE.
+    """
+    sketch = json.loads(sketch) if isinstance(sketch, str) else sketch
+    if sketch.get("precision", HLL_PRECISION) != HLL_PRECISION:
+        raise ValueError(f"Kutilmagan HLL aniqligi: {sketch.get('precision')}")
+    registers = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    if "dense" in sketch:
+        registers[:] = np.asarray(sketch["dense"], dtype=np.uint8) + rank_offset
+    else:
+        sparse = sketch.get("sparse", {})
+        registers[sparse.get("indices", [])] = np.asarray(sparse.get("maxLzCounts", []), dtype=np.uint8) + rank_offset
+    return registers
+
+
+def _prepare_hll(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert exported sketches to packed registers, after checking that they
+    reproduce HLL_ESTIMATE on the largest sketches of the batch.
+
+    The export format does not say whether its counts are ranks or leading-zero
+    counts (one less); the wrong reading roughly halves or doubles every
+    estimate, so the offset that matches Snowflake is used, and the sync fails
+    if neither does.
+    """
+    rank_offset = 0
+    if not df.empty:
+        sample = df.nlargest(HLL_CHECK_ROWS, "ESTIMATE")
+        expected = sample["ESTIMATE"].astype(float).clip(lower=1).to_numpy()
+        errors = {}
+        for offset in (0, 1):
+            local = np.array([hll_estimate(hll_registers(sketch, offset)) for sketch in sample["SKETCH"]])
+            errors[offset] = float(np.median(np.abs(local - expected) / expected))
+        rank_offset = min(errors, key=errors.get)
+        if errors[rank_offset] > HLL_CHECK_TOLERANCE:
+            raise ValueError(f"HLL_EXPORT sketchlari HLL_ESTIMATE bilan mos kelmadi (xato {errors[rank_offset]:.0%})")
+    df = df.drop(columns="ESTIMATE")
+    df["SKETCH"] = [hll_pack(hll_registers(sketch, rank_offset)) for sketch in df["SKETCH"]]
+    return df
+
+
+def hll_pack(registers: np.ndarray) -> bytes:
+    # Small groups leave most registers at zero, so they compress well
+    return zlib.compress(registers.tobytes())
+
+
+def hll_merge(blobs) -> np.ndarray:
+    """Union of packed sketches: the register-wise maximum."""
+    merged = np.zeros(HLL_REGISTERS, dtype=np.uint8)
+    for blob in blobs:
+        np.maximum(merged, np.frombuffer(zlib.decompress(blob), dtype=np.uint8), out=merged)
+    return merged
+
+
+def hll_estimate(registers: np.ndarray) -> int:
+    """Cardinality estimate, about ±1.6% (one standard error) at 4096 registers.
+
+    Small ranges use linear counting over the empty registers, which is close
+    to exact there; 64-bit hashes make a large-range correction unnecessary.
+    """
+    m = HLL_REGISTERS
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int32)))
+    empty = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and empty:
+        estimate = m * np.log(m / empty)
+    return int(round(estimate))
+
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _merged_sketches(synced_at: float, by: str, date_from: str) -> dict:
+    """Union of the daily sketches per value of `by` ("platform" or
+    "client_version") from date_from on, for one version of the store."""
+    rows = get_rollup_store().query(f"""
+        SELECT {by}, registers FROM user_hll
+        WHERE game_id = :game_id AND (:date_from IS NULL OR event_date >= :date_from)
+    """, {"date_from": date_from})
+    blobs = {}
+    for key, blob in rows:
+        blobs.setdefault(key, []).append(blob)
+    return {key: hll_merge(group) for key, group in blobs.items()}
+
+
+def _sketch_users(by: str, column: str, date_from=None, label=None) -> pd.DataFrame:
+    """Distinct users per value of `by` (optionally relabelled), largest first."""
+    store = get_rollup_store()
+    stale_at = store.ensure("user_hll")
+    merged = _merged_sketches(store.state("user_hll")[2], by, None if date_from is None else str(date_from))
+    groups = {}
+    for key, registers in merged.items():
+        key = key if label is None else label(key)
+        groups[key] = registers if key not in groups else np.maximum(groups[key], registers)
+    df = pd.DataFrame(
+        [(key, hll_estimate(registers)) for key, registers in groups.items()],
+        columns=[column, "USERS"],
+    )
+    df = df.sort_values("USERS", ascending=False, ignore_index=True)
+    return _with_as_of(df, stale_at)
+
+
+def hll_platform_users() -> pd.DataFrame:
+    platforms = {"ANDROID": "Android", "IOS": "iOS"}
+    return _sketch_users("platform", "PLATFORM", label=lambda platform: platforms.get(platform, "Boshqalar"))
+
+
+def hll_version_users(date_from) -> pd.DataFrame:
+    return _sketch_users("client_version", "CLIENT_VERSION", date_from)
+
+
+def hll_last_version() -> pd.DataFrame:
+    """The client version seen on the latest day, over all history."""
+    return get_rollup_store().frame("user_hll", """
+        SELECT client_version AS LAST_UPDATE_VERSION FROM user_hll
+        WHERE game_id = :game_id AND client_version != 'Noma''lum'
+        ORDER BY event_date DESC
+        LIMIT 1
+    """, {})
+
+
+# ----------------------------
+# Activity bitmaps: exact active-user sets per day over dense user ids
+# ----------------------------
+def bitmap_from_ids(ids) -> int:
+    """Bitset (a Python int, bit i = user i) of dense user ids."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return 0
+    bits = np.zeros(int(ids.max()) + 1, dtype=bool)
+    bits[ids] = True
+    return int.from_bytes(np.packbits(bits, bitorder="little").tobytes(), "little")
+
+
+def bitmap_pack(bitmap: int) -> bytes:
+    # Users keep their first-seen id, so long-gone users leave zero runs that compress away
+    return zlib.compress(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little"))
+
+
+def bitmap_unpack(blob: bytes) -> int:
+    return int.from_bytes(zlib.decompress(blob), "little")
+
+
+def _assign_user_ids(db, user_ids) -> dict:
+    """Dense ids for the given users, giving new users the next free ones.
+
+    Both the activity and the first-seen rollups assign ids, so every first-seen
+    user has a cohort bit whichever of the two synced first.
+    """
+    db.execute("CREATE TEMP TABLE IF NOT EXISTS incoming (user_id TEXT PRIMARY KEY)")
+    db.execute("DELETE FROM incoming")
+    db.executemany("INSERT OR IGNORE INTO incoming VALUES (?)", ((user,) for user in user_ids))
+    db.execute("""
+        INSERT INTO user_ids (game_id, user_id, idx)
+        SELECT :game_id, user_id,
+               (SELECT COALESCE(MAX(idx), -1) FROM user_ids WHERE game_id = :game_id)
+               + ROW_NUMBER() OVER (ORDER BY user_id)
+        FROM incoming
+        WHERE user_id NOT IN (SELECT user_id FROM user_ids WHERE game_id = :game_id)
+    """, {"game_id": GAME_ID})
+    return dict(db.execute(
+        "SELECT i.user_id, u.idx FROM incoming i JOIN user_ids u ON u.game_id = ? AND u.user_id = i.user_id",
+        (GAME_ID,),
+    ))
+
+
+def _build_activity(db, df: pd.DataFrame) -> list:
+    """Map users to their dense ids, then pack each day's active users."""
+    ids = _assign_user_ids(db, df["USER_ID"].astype(str).unique())
+    idx = df["USER_ID"].astype(str).map(ids)
+    return [
+        (GAME_ID, day, bitmap_pack(bitmap_from_ids(day_idx)))
+        for day, day_idx in idx.groupby(df["SANA"].to_numpy())
+    ]
+
+
+def _build_first_seen(db, df: pd.DataFrame) -> list:
+    """First-seen rows as they are, after making sure every user has a dense id."""
+    _assign_user_ids(db, df["USER_ID"].unique())
+    return [(GAME_ID, *row) for row in df.itertuples(index=False)]
+
+
+class ActivityIndex:
+    """Per-day active-user bitsets, loaded from the rollup store and kept in memory.
+
+    DAU is a popcount, any window's active users an OR over its days, and overlap
+    between two windows an AND, all exact. Only days the last sync may have
+    replaced (the trailing LATE_DATA_DAYS) are reloaded when the store changes.
+    """
+
+    def __init__(self):
+        self.days = {}  # "YYYY-MM-DD" -> bitset
+        self._synced_at = None
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> tuple:
+        """(days, stale_at): the current bitsets, and the last sync time if serving stale data."""
+        store = get_rollup_store()
+        stale_at = store.ensure("activity")
+        state = store.state("activity")
+        with self._lock:
+            if state is not None and state[2] != self._synced_at:
+                since = HISTORY_START.isoformat()
+                if self.days:
+                    since = (date.fromisoformat(max(self.days)) - timedelta(days=LATE_DATA_DAYS)).isoformat()
+                for day in [day for day in self.days if day >= since]:
+                    del self.days[day]
+                rows = store.query(
+                    "SELECT event_date, bitmap FROM user_activity WHERE game_id = :game_id AND event_date >= :since",
+                    {"since": since},
+                )
+                self.days.update((day, bitmap_unpack(blob)) for day, blob in rows)
+                self._synced_at = state[2]
+            return dict(self.days), stale_at
+
+
+@st.cache_resource
+def get_activity_index() -> ActivityIndex:
+    return ActivityIndex()
+
+
+def _active(days: dict, date_from, date_to) -> int:
+    """Users active on any day in [date_from, date_to]."""
+    users = 0
+    day = date_from
+    while day <= date_to:
+        users |= days.get(day.isoformat(), 0)
+        day += timedelta(days=1)
+    return users
+
+
+def _with_as_of(df: pd.DataFrame, stale_at) -> pd.DataFrame:
+    return df if stale_at is None else _as_of(df, stale_at)
+
+
+def activity_trend(date_from, date_to) -> pd.DataFrame:
+    """DAU per day (from the shared daily frame) with the trailing 7-day WAU and
+    30-day MAU from the activity bitmaps and stickiness (DAU / MAU, %)."""
+    df = daily_activity(date_from, date_to)
+    df = df.loc[df["DAU"] > 0, ["SANA", "DAU"]].reset_index(drop=True)
+    days, stale_at = get_activity_index().snapshot()
+    df["WAU"] = [
+        _active(days, day - timedelta(days=6), day).bit_count()
+        for day in df["SANA"].dt.date
+    ]
+    df["MAU"] = [
+        _active(days, day - timedelta(days=29), day).bit_count()
+        for day in df["SANA"].dt.date
+    ]
+    df["YOPISHQOQLIK"] = (df["DAU"] * 100 / df["MAU"].where(df["MAU"] > 0)).round(1)
+    if stale_at is not None and "as_of" not in df.attrs:
+        _as_of(df, stale_at)
+    return df
+
+
+def activity_month_users(month, date_from, date_to) -> pd.DataFrame:
+    """MAU for one month plus how many of them were also active the month before."""
+    days, stale_at = get_activity_index().snapshot()
+    users = _active(days, date_from, date_to)
+    previous = _active(days, (month - timedelta(days=1)).replace(day=1), month - timedelta(days=1))
+    df = pd.DataFrame({
+        "OY": [pd.Timestamp(month)],
+        "MAU": [users.bit_count()],
+        "QOLGANLAR": [(users & previous).bit_count()],
+    })
+    return _with_as_of(df, stale_at)
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _first_seen_cohorts(synced_at: float) -> dict:
+    """First-seen date -> bitset of the users first seen that day, for one version of the store."""
+    rows = get_rollup_store().query("""
+        SELECT f.first_date, u.idx
+        FROM user_first_seen f
+        JOIN user_ids u ON u.game_id = f.game_id AND u.user_id = f.user_id
+        WHERE f.game_id = :game_id
+    """, {})
+    df = pd.DataFrame(rows, columns=["first_date", "idx"])
+    return {day: bitmap_from_ids(idx) for day, idx in df.groupby("first_date")["idx"]}
+
+
+RETENTION_DAYS = (1, 7, 30)
+
+
+def retention_rates(offsets=RETENTION_DAYS) -> pd.DataFrame:
+    """Day-N retention for every offset in one pass over the first-seen cohorts.
+
+    A cohort only counts towards offset N once its day N is complete (yesterday
+    at the latest), so young cohorts no longer dilute the longer offsets.
+    Columns: KUN (offset), RET (% or None), USERS (eligible cohort size).
+    """
+    store = get_rollup_store()
+    stale = [store.ensure("first_seen")]
+    activity, activity_stale = get_activity_index().snapshot()
+    stale.append(activity_stale)
+    cohorts = _first_seen_cohorts(store.state("first_seen")[2])
+    last_day = min(date.fromisoformat(max(activity)), datetime.now().date() - timedelta(days=1)) if activity else None
+    returned = dict.fromkeys(offsets, 0)
+    eligible = dict.fromkeys(offsets, 0)
+    for day, users in cohorts.items():
+        first_date = date.fromisoformat(day)
+        size = users.bit_count()
+        for offset in offsets:
+            target = first_date + timedelta(days=offset)
+            if last_day is None or target > last_day:
+                continue
+            eligible[offset] += size
+            returned[offset] += (users & activity.get(target.isoformat(), 0)).bit_count()
+    df = pd.DataFrame({
+        "KUN": list(offsets),
+        "RET": [round(returned[n] * 100 / eligible[n], 1) if eligible[n] else None for n in offsets],
+        "USERS": [eligible[n] for n in offsets],
+    })
+    stale = [stale_at for stale_at in stale if stale_at is not None]
+    return _with_as_of(df, min(stale) if stale else None)
+
+
+# Cohort matrix period -> (grain, days per step, last offset, cohorts shown)
+RETENTION_GRAINS = {
+    "Kunlik": ("day", 1, 30, 30),
+    "Haftalik": ("week", 7, 12, 16),
+}
+
+
+def retention_matrix(period: str) -> pd.DataFrame:
+    """Cohort x offset retention, computing only cells that are new or still open.
+
+    Only the cohorts shown are visited. A cell is complete, and never
+    recomputed, once both its cohort and its target period lie before the
+    late-data window; newer cells are refreshed on each call. Week cohorts
+    start on Monday and count users active on any day of the target week.
+    Columns: KOHORTA, KUN (offset), USERS, RET (%).
+    """
+    grain, step, last_offset, shown = RETENTION_GRAINS[period]
+    store = get_rollup_store()
+    stale = [store.ensure("first_seen")]
+    activity, activity_stale = get_activity_index().snapshot()
+    stale.append(activity_stale)
+    stale = [stale_at for stale_at in stale if stale_at is not None]
+    columns = ["KOHORTA", "KUN", "USERS", "RET"]
+    cohorts = _first_seen_cohorts(store.state("first_seen")[2])
+    if not activity or not cohorts:
+        return pd.DataFrame(columns=columns)
+    last_day = min(date.fromisoformat(max(activity)), datetime.now().date() - timedelta(days=1))
+    closed_day = last_day - timedelta(days=LATE_DATA_DAYS)
+    since = max(date.fromisoformat(min(cohorts)), last_day - timedelta(days=(shown - 1) * step))
+    since -= timedelta(days=since.weekday() if step == 7 else 0)  # week cohorts start on Monday
+
+    done = set(store.query("""
+        SELECT cohort, day_offset FROM retention_cells
+        WHERE game_id = :game_id AND grain = :grain AND complete = 1 AND cohort >= :since
+    """, {"grain": grain, "since": since.isoformat()}))
+    cells = []
+    cohort = since
+    while cohort <= last_day:
+        users = None
+        for offset in range(last_offset + 1):
+            period_start = cohort + timedelta(days=offset * step)
+            period_end = period_start + timedelta(days=step - 1)
+            if period_end > last_day:
+                break
+            if (cohort.isoformat(), offset) in done:
+                continue
+            if users is None:
+                users = _active(cohorts, cohort, cohort + timedelta(days=step - 1))
+            if not users:
+                break  # nobody was first seen in this cohort
+            returned = (users & _active(activity, period_start, period_end)).bit_count()
+            cells.append((
+                GAME_ID, grain, cohort.isoformat(), offset,
+                users.bit_count(), returned, int(period_end <= closed_day),
+            ))
+        cohort += timedelta(days=step)
+    if cells:
+        store.write("INSERT OR REPLACE INTO retention_cells VALUES (?, ?, ?, ?, ?, ?, ?)", cells)
+
+    rows = store.query("""
+        SELECT cohort, day_offset, cohort_users, ROUND(returned * 100.0 / cohort_users, 1)
+        FROM retention_cells
+        WHERE game_id = :game_id AND grain = :grain AND cohort >= :since AND cohort_users > 0
+        ORDER BY cohort, day_offset
+    """, {"grain": grain, "since": since.isoformat()})
+    return _with_as_of(pd.DataFrame(rows, columns=columns), min(stale) if stale else None)
+
+
+MINIGAME_ORIGINAL = {v: k for k, v in MINIGAME_NAMES.items()}
+SESSION_PERIOD_DAYS = {"So'nggi 7 kun": 7, "So'nggi 14 kun": 14, "So'nggi 30 kun": 30}
+DAU_PERIOD_DAYS = {"So'nggi 7 kun": 7, "So'nggi 14 kun": 14, "So'nggi 30 kun": 30, "So'nggi 90 kun": 90}
+MAU_PERIOD_MONTHS = {"So'nggi 6 oy": 6, "So'nggi 12 oy": 12}
+TOP_GAMES_PERIOD_DAYS = {"So'nggi 7 kun": 7, "So'nggi 30 kun": 30, "So'nggi 90 kun": 90}
+
+# ----------------------------
+# Query registry: every warehouse query by name. Values are passed as %(name)s
+# bind variables, so the SQL text never changes and Snowflake can reuse its
+# plans and result cache; only the table path is formatted in.
+# ----------------------------
+QUERY_DEFAULTS = {"game_id": GAME_ID}
+
+QUERIES = {
+    "watermark_sessions_day": f"""
+        SELECT MAX(EVENT_DATE) AS WM_DATE, MAX(EVENT_DATE) || ':' || COUNT(*) AS WM_TOKEN
         FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE = '{yesterday.strftime("%Y-%m-%d")}'
-    """)
-    kpi_dau = int(dau_df["DAU"][0])
-except Exception:
-    kpi_dau = None
-
-# MAU - Monthly Active Users (last 30 days)
-try:
-    mau_end = datetime.now()
-    mau_start = mau_end - timedelta(days=30)
-    mau_df = run_query(f"""
-        SELECT COUNT(DISTINCT USER_ID) as MAU
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_DATE >= DATEADD(day, -%(late)s, CURRENT_DATE())
+    """,
+    "watermark_events": f"""
+        SELECT MAX(EVENT_TIMESTAMP)::DATE AS WM_DATE, MAX(EVENT_TIMESTAMP)::STRING AS WM_TOKEN
+        FROM {DB}.ACCOUNT_EVENTS
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_TIMESTAMP >= DATEADD(day, -%(late)s, CURRENT_TIMESTAMP())
+    """,
+    # KPI row in one pruned scan: DAU (yesterday), MAU (30 days) and sessions (7 days);
+    # sessions are counted over the whole window, so one crossing midnight counts once
+    "kpi": f"""
+        SELECT
+            COUNT(DISTINCT IFF(EVENT_DATE = %(dau_date)s, USER_ID, NULL)) as DAU,
+            COUNT(DISTINCT USER_ID) as MAU,
+            COUNT(DISTINCT IFF(EVENT_DATE >= %(sessions_from)s, SESSION_ID, NULL)) as TOTAL_SESS
         FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE BETWEEN '{mau_start.strftime("%Y-%m-%d")}' AND '{mau_end.strftime("%Y-%m-%d")}'
-    """)
-    kpi_mau = int(mau_df["MAU"][0])
-except Exception:
-    kpi_mau = None
-
-try:
-    end_dt = datetime.now()
-    start_dt = end_dt - timedelta(days=7)
-    sess_kpi_df = run_query(f"""
-        SELECT COUNT(DISTINCT SESSION_ID) as TOTAL_SESS
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_DATE BETWEEN %(date_from)s AND %(date_to)s
+    """,
+    # Events and distinct users per local (UTC+5) hour over a half-open UTC range;
+    # EVENT_TIMESTAMP is compared unwrapped so the range prunes micro-partitions
+    "hourly_activity": f"""
+        SELECT
+            DATE_TRUNC('hour', DATEADD(hour, 5, EVENT_TIMESTAMP)) as SOAT_BOSHI,
+            COUNT(*) as HODISALAR,
+            COUNT(DISTINCT USER_ID) as FOYDALANUVCHILAR
+        FROM {DB}.ACCOUNT_EVENTS
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_TIMESTAMP >= %(utc_from)s
+        AND EVENT_TIMESTAMP < %(utc_to)s
+        GROUP BY DATE_TRUNC('hour', DATEADD(hour, 5, EVENT_TIMESTAMP))
+    """,
+    # Incremental rollup sources, see RollupStore
+    "rollup_daily": f"""
+        SELECT
+            EVENT_DATE as SANA,
+            COUNT(DISTINCT USER_ID) as DAU,
+            COUNT(DISTINCT SESSION_ID) as SESSIYALAR,
+            COALESCE(SUM(TOTAL_TIME_MS), 0) as TOTAL_TIME_MS,
+            COUNT(TOTAL_TIME_MS) as TIME_ROWS
         FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE BETWEEN '{start_dt.strftime("%Y-%m-%d")}' AND '{end_dt.strftime("%Y-%m-%d")}'
-    """)
-    kpi_sessions = int(sess_kpi_df["TOTAL_SESS"][0])
-except Exception:
-    kpi_sessions = None
-
-# DAU - Daily Active Users (yesterday, as today may be incomplete)
-try:
-    yesterday = datetime.now() - timedelta(days=1)
-    dau_df = run_query(f"""
-        SELECT COUNT(DISTINCT USER_ID) as DAU
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_DATE >= %(date_from)s
+        GROUP BY EVENT_DATE
+    """,
+    "rollup_first_seen": f"""
+        SELECT
+            MAX(EVENT_DATE) as SANA,
+            USER_ID,
+            MIN(EVENT_DATE) as FIRST_DATE,
+            MIN_BY(COALESCE(PLATFORM, ''), EVENT_DATE) as FIRST_PLATFORM,
+            MIN_BY(COALESCE(CLIENT_VERSION, 'Noma''lum'), EVENT_DATE) as FIRST_VERSION
         FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE = '{yesterday.strftime("%Y-%m-%d")}'
-    """)
-    kpi_dau = int(dau_df["DAU"][0])
-except Exception:
-    kpi_dau = None
-
-# MAU - Monthly Active Users (last 30 days)
-try:
-    mau_end = datetime.now()
-    mau_start = mau_end - timedelta(days=30)
-    mau_df = run_query(f"""
-        SELECT COUNT(DISTINCT USER_ID) as MAU
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_DATE >= %(date_from)s
+        GROUP BY USER_ID
+    """,
+    "rollup_activity": f"""
+        SELECT DISTINCT EVENT_DATE as SANA, USER_ID
+        FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_DATE >= %(date_from)s
+    """,
+    "rollup_user_hll": f"""
+        SELECT
+            EVENT_DATE as SANA,
+            COALESCE(PLATFORM, '') as PLATFORM,
+            COALESCE(CLIENT_VERSION, 'Noma''lum') as CLIENT_VERSION,
+            HLL_EXPORT(HLL_ACCUMULATE(USER_ID)) as SKETCH,
+            HLL_ESTIMATE(HLL_ACCUMULATE(USER_ID)) as ESTIMATE
         FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE BETWEEN '{mau_start.strftime("%Y-%m-%d")}' AND '{mau_end.strftime("%Y-%m-%d")}'
-    """)
-    kpi_mau = int(mau_df["MAU"][0])
-except Exception:
-    kpi_mau = None
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_DATE >= %(date_from)s
+        GROUP BY EVENT_DATE, COALESCE(PLATFORM, ''), COALESCE(CLIENT_VERSION, 'Noma''lum')
+    """,
+    "rollup_minigame_events": f"""
+        SELECT
+            DATE(EVENT_TIMESTAMP) as SANA,
+            TO_VARCHAR(EVENT_TIMESTAMP, 'YYYY-MM-DD HH24:MI:SS.FF3') as EVENT_TS,
+            COALESCE(USER_ID::STRING, '') as USER_ID,
+            COALESCE(SESSION_ID::STRING, '') as SESSION_ID,
+            COALESCE(EVENT_JSON:MiniGameName::STRING, '') as MINI_GAME,
+            COALESCE(EVENT_JSON:Status::STRING, '') as STATUS
+        FROM {DB}.ACCOUNT_EVENTS
+        WHERE GAME_ID = %(game_id)s
+        AND EVENT_NAME = 'playedMiniGameStatus'
+        AND EVENT_TIMESTAMP >= %(date_from)s
+    """,
+}
+
+_BIND_PARAM = re.compile(r"%\((\w+)\)s")
+
+
+def normalize_params(name: str, params: dict = None) -> tuple:
+    """Sorted (name, value) pairs the query actually binds, defaults filled in."""
+    values = {**QUERY_DEFAULTS, **(params or {})}
+    return tuple((param, values[param]) for param in sorted(set(_BIND_PARAM.findall(QUERIES[name]))))
+
+
+def bind_query(name: str, params=()) -> tuple:
+    """(SQL with ? placeholders, bind values in placeholder order) for execution."""
+    values = dict(normalize_params(name, dict(params)))
+    binds = []
+
+    def placeholder(match):
+        binds.append(values[match.group(1)])
+        return "?"
+
+    return _BIND_PARAM.sub(placeholder, QUERIES[name]), binds
+
+
+def query_key(name: str, params: tuple) -> str:
+    """Cache key: query name + normalized params (+ SQL fingerprint, so edits invalidate).
+
+    Only the parameters are normalized. The SQL is fingerprinted and executed
+    exactly as written in QUERIES, so string literals are never rewritten.
+    """
+    fingerprint = hashlib.sha256(QUERIES[name].encode()).hexdigest()[:12]
+    return f"{name}@{fingerprint}(" + ", ".join(f"{param}={value!r}" for param, value in params) + ")"
+
+# ----------------------------
+# Query plan: every section's query and parameters come from the current widget
+# state and are submitted at once, so the page waits for the slowest query, not the sum.
+# ----------------------------
+now = datetime.now()
+yesterday = now - timedelta(days=1)
+local_today = local_now().date()  # the hourly rollup is keyed by UTC+5 dates
+NEW_USERS_DEFAULT_RANGE = (RELEASE_DATE, now.date())
+MG_DEFAULT_RANGE = (now.date() - timedelta(days=30), now.date())
+HEATMAP_DEFAULT_RANGE = (local_today - timedelta(days=28), local_today - timedelta(days=1))
+
+page_queries = {}  # section -> (registry name, params)
+page_rollups = {}  # section -> (rollup reader, args), answered from the local store
+
+# KPI cards: DAU (yesterday, as today may be incomplete), MAU (last 30 days) and
+# sessions (last 7 days) in one query; total users and the latest version from the store
+page_queries["kpi"] = ("kpi", {
+    "dau_date": yesterday.date(),
+    "sessions_from": (now - timedelta(days=7)).date(),
+    "date_from": (now - timedelta(days=30)).date(),
+    "date_to": now.date(),
+})
+page_rollups["total_users"] = (first_seen_total_users, ())
+
+page_rollups["platform"] = (hll_platform_users, ())
+page_rollups["versions"] = (hll_version_users, (RELEASE_DATE,))
+page_rollups["last_version"] = (hll_last_version, ())
+
+# New users: Kunlik / Haftalik / Oylik over the selected range
+new_users_range = widget_value("new_users_date", NEW_USERS_DEFAULT_RANGE)
+if len(new_users_range) == 2:
+    # Har doim 27-dekabrdan boshlanadi
+    nu_start = max(new_users_range[0], RELEASE_DATE)
+    nu_end = new_users_range[1] + timedelta(days=1)
+    page_rollups["new_users"] = (first_seen_new_users, (widget_value("new_users_period", "Kunlik"), nu_start, nu_end))
+
+# Sessions: hourly for one date, or daily for a preset period
+if widget_value("session_view", "Kunlik") == "Soatlik":
+    page_rollups["sessions"] = (hourly_activity, (widget_value("session_date", local_today),))
+else:
+    session_period = widget_value("session_period", "Hammasi")
+    if session_period == "Hammasi":
+        sess_start = RELEASE_DATE
+    else:
+        sess_start = (now - timedelta(days=SESSION_PERIOD_DAYS[session_period])).date()
+    page_rollups["sessions"] = (daily_sessions, (sess_start, now.date()))
+
+# DAU trend ends yesterday; the 90-day option starts at the release date
+dau_period = widget_value("dau_period", "So'nggi 7 kun")
+if dau_period == "So'nggi 90 kun":
+    dau_start = RELEASE_DATE
+else:
+    dau_start = (yesterday - timedelta(days=DAU_PERIOD_DAYS[dau_period])).date()
+page_rollups["dau_trend"] = (activity_trend, (dau_start, yesterday.date()))
+
+# MAU trend: release bolgan vaqtdan boshlab analiz qilsin.
+# One bitmap union per month, with the overlap against the month before.
+mau_start = now.date() - timedelta(days=MAU_PERIOD_MONTHS[widget_value("mau_period", "So'nggi 6 oy")] * 30)
+mau_start = max(mau_start, RELEASE_DATE)
+mau_month_keys = []
+month = mau_start.replace(day=1)
+while month <= now.date():
+    next_month = (month + timedelta(days=32)).replace(day=1)
+    month_from = max(month, mau_start)
+    month_to = min(next_month - timedelta(days=1), now.date())
+    key = f"mau_{month:%Y_%m}"
+    page_rollups[key] = (activity_month_users, (month, month_from, month_to))
+    mau_month_keys.append(key)
+    month = next_month
+
+# Mini-games: list, trend and top-5 are all slices of one cached (date, game) cube
+page_rollups["mg_list"] = (minigame_list, ())
+
+mg_range = widget_value("mg_date", MG_DEFAULT_RANGE)
+if len(mg_range) == 2:
+    mg_start = max(mg_range[0], RELEASE_DATE)
+    selected_mg = widget_value("mg_filter", "Barchasi")
+    original_name = None if selected_mg == "Barchasi" else MINIGAME_ORIGINAL.get(selected_mg, selected_mg)
+    page_rollups["mg_trend"] = (minigame_plays, (mg_start, mg_range[1], original_name))
+    page_rollups["mg_funnel"] = (minigame_funnel, (mg_start, mg_range[1]))
+
+top_games_period = widget_value("top_games_period", "Hammasi")
+if top_games_period == "Hammasi":
+    page_rollups["top_games"] = (minigame_top, ())
+else:
+    top_start = (now - timedelta(days=TOP_GAMES_PERIOD_DAYS[top_games_period])).date()
+    page_rollups["top_games"] = (minigame_top, (top_start, now.date()))
+
+page_rollups["retention"] = (retention_rates, ())
+page_rollups["retention_matrix"] = (retention_matrix, (widget_value("retention_grain", "Kunlik"),))
+
+# Weekday x hour heatmap: one grouping of the hourly rollup for the whole range
+heatmap_range = widget_value("heatmap_date", HEATMAP_DEFAULT_RANGE)
+if len(heatmap_range) == 2:
+    page_rollups["heatmap"] = (hourly_heatmap, (heatmap_range[0], heatmap_range[1]))
+
+# A widget change starts a new run: queries still running for the old one are
+# aborted, unless this run's plan asks for them again
+script_run = begin_script_run(
+    query_key(name, normalize_params(name, params)) for name, params in page_queries.values()
+)
+try:
+    section_results = {
+        section: submit_query(name, params, script_run)
+        for section, (name, params) in page_queries.items()
+    }
+    section_results.update({
+        section: submit_task(reader, *args, run=script_run)
+        for section, (reader, args) in page_rollups.items()
+    })
+
+
+    # Get current timestamp for last update
+    last_update_date = "15.01.2026"
+    try:
+        last_ver_df = section_results["last_version"].result()
+        last_update_version = last_ver_df["LAST_UPDATE_VERSION"][0] if not last_ver_df.empty else "N/A"
+    except Exception:
+        last_update_version = "N/A"
+
+
+
+
+    st.markdown(f'''
+<div class="header">
+    <img src="data:image/png;base64,{LOGO_BASE64}" style="height:60px;width:auto;" />
+</div>
+''', unsafe_allow_html=True)
+
+
+    # ----------------------------
+    # KPI (4 cards) - all KPI queries were submitted together above
+    # ----------------------------
+    kpi_frames = []
+
+
+    def kpi_value(name: str, column: str):
+        """Integer KPI from a section result; None when it is unavailable."""
+        try:
+            df = section_results[name].result()
+            value = int(df[column][0])
+        except Exception:
+            return None
+        kpi_frames.append(df)
+        return value
 
-st.markdown(
-    f"""
+
+    kpi_total_users = kpi_value("total_users", "TOTAL")
+    kpi_dau = kpi_value("kpi", "DAU")
+    kpi_mau = kpi_value("kpi", "MAU")
+    kpi_sessions = kpi_value("kpi", "TOTAL_SESS")
+
+    st.markdown(
+        f"""
 <div class="kpi-grid">
   <div class="kpi card">
     <div class="kpi-head">
@@ -1026,98 +3046,82 @@ st.markdown(
     </div>
 </div>
 """,
-    unsafe_allow_html=True,
-)
+        unsafe_allow_html=True,
+    )
+    show_as_of(*kpi_frames)
 
 
-# ----------------------------
-# 1) Platform donut + legend
-# ----------------------------
-st.markdown(
-    """
+    # ----------------------------
+    # 1) Platform donut + legend
+    # ----------------------------
+    st.markdown(
+        """
 <div class="sec-row">
   <div>
     <div class="sec-title">📱 Platformalar</div>
-    <div class="sec-sub">Foydalanuvchilar taqsimoti</div>
+    <div class="sec-sub">Foydalanuvchilar taqsimoti (taxminiy, ≈ ±2%)</div>
   </div>
   <div></div>
 </div>
 """,
-    unsafe_allow_html=True,
-)
-
-try:
-    platform_df = run_query(f"""
-        SELECT
-            PLATFORM_GROUP AS PLATFORM,
-            SUM(USERS) AS USERS
-        FROM (
-            SELECT
-                CASE
-                    WHEN PLATFORM = 'ANDROID' THEN 'Android'
-                    WHEN PLATFORM = 'IOS' THEN 'iOS'
-                    ELSE 'Boshqalar'
-                END AS PLATFORM_GROUP,
-                COUNT(DISTINCT USER_ID) AS USERS
-            FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-            WHERE GAME_ID = {GAME_ID}
-            GROUP BY PLATFORM
-        )
-        GROUP BY PLATFORM_GROUP
-        ORDER BY USERS DESC
-    """)
-
-    if not platform_df.empty:
-        total = int(platform_df["USERS"].sum())
-        platform_df["PERCENT"] = (platform_df["USERS"] / total * 100).round(1)
-
-        CHART_H = 300
-        c_chart, c_nums = st.columns([1.25, 0.85], gap="large", vertical_alignment="center")
+        unsafe_allow_html=True,
+    )
 
-        with c_chart:
-            donut = (
-                alt.Chart(platform_df)
-                .mark_arc(innerRadius=118, outerRadius=150, opacity=0.92)
-                .encode(
-                    theta=alt.Theta(field="USERS", type="quantitative"),
-                    color=alt.Color(
-                        field="PLATFORM",
-                        type="nominal",
-                        scale=alt.Scale(
-                            domain=["Android", "iOS", "Boshqalar"],
-                            range=[COLORS["android"], COLORS["ios"], COLORS["other"]],
+    try:
+        platform_df = section_results["platform"].result()
+        show_as_of(platform_df)
+
+        if not platform_df.empty:
+            total = int(platform_df["USERS"].sum())
+            platform_df["PERCENT"] = (platform_df["USERS"] / total * 100).round(1)
+
+            CHART_H = 300
+            c_chart, c_nums = st.columns([1.25, 0.85], gap="large", vertical_alignment="center")
+
+            with c_chart:
+                donut = (
+                    alt.Chart(platform_df)
+                    .mark_arc(innerRadius=118, outerRadius=150, opacity=0.92)
+                    .encode(
+                        theta=alt.Theta(field="USERS", type="quantitative"),
+                        color=alt.Color(
+                            field="PLATFORM",
+                            type="nominal",
+                            scale=alt.Scale(
+                                domain=["Android", "iOS", "Boshqalar"],
+                                range=[COLORS["android"], COLORS["ios"], COLORS["other"]],
+                            ),
+                            legend=None,
                         ),
-                        legend=None,
-                    ),
-                    tooltip=[
-                        alt.Tooltip("PLATFORM:N", title="Platforma"),
-                        alt.Tooltip("USERS:Q", title="Foydalanuvchilar", format=","),
-                        alt.Tooltip("PERCENT:Q", title="Ulush", format=".1f"),
-                    ],
+                        tooltip=[
+                            alt.Tooltip("PLATFORM:N", title="Platforma"),
+                            alt.Tooltip("USERS:Q", title="Foydalanuvchilar (≈)", format=","),
+                            alt.Tooltip("PERCENT:Q", title="Ulush", format=".1f"),
+                        ],
+                    )
+                    .properties(height=CHART_H, padding={"top": 6, "left": 8, "right": 8, "bottom": 8})
                 )
-                .properties(height=CHART_H, padding={"top": 6, "left": 8, "right": 8, "bottom": 8})
-            )
-            st.altair_chart(donut, width="stretch")
+                st.altair_chart(donut, width="stretch")
 
-        with c_nums:
-            # Build legend HTML as single block
-            legend_html = f'''
+            with c_nums:
+                # Build legend HTML as single block
+                legend_html = f'''
 <div class="stat-row">
   <div>
     <div class="stat-left"><span class="dot" style="background:{COLORS["accent"]};"></span>
       <span class="stat-label">Jami</span>
     </div>
   </div>
-  <div class="stat-right">{total:,}</div>
+  <div class="stat-right">≈{total:,}</div>
 </div>'''
 
-            for _, r in platform_df.iterrows():
-                p = r["PLATFORM"]
-                u = int(r["USERS"])
-                pr = float(r["PERCENT"])
-                color = COLORS["android"] if p == "Android" else COLORS["ios"] if p == "iOS" else COLORS["other"]
+                for _, r in platform_df.iterrows():
+                    p = r["PLATFORM"]
+                    u = int(r["USERS"])
+                    pr = float(r["PERCENT"])
+                    color = COLORS["android"] if p == "Android" else COLORS["ios"] if p == "iOS" else COLORS["other"]
 
-                legend_html += f'''
+                    legend_html += f'''
 <div class="stat-row">
   <div>
     <div class="stat-left"><span class="dot" style="background:{color};"></span>
@@ -1125,133 +3129,125 @@ try:
     </div>
     <div class="stat-sub">{pr:.1f}%</div>
   </div>
-  <div class="stat-right">{u:,}</div>
+  <div class="stat-right">≈{u:,}</div>
 </div>'''
 
-            st.markdown(f'<div class="legend-card card" style="background: #FFFFFF; border: 1px solid rgba(15,23,42,0.14); border-radius: 18px; padding: 16px; box-shadow: 0 10px 24px rgba(15,23,42,0.06);">{legend_html}</div>', unsafe_allow_html=True)
+                st.markdown(f'<div class="legend-card card" style="background: #FFFFFF; border: 1px solid rgba(15,23,42,0.14); border-radius: 18px; padding: 16px; box-shadow: 0 10px 24px rgba(15,23,42,0.06);">{legend_html}</div>', unsafe_allow_html=True)
 
-    else:
-        st.info("Ma'lumotlar mavjud emas")
-except Exception as e:
-    st.error(f"Platformalar xatolik: {e}")
+        else:
+            st.info("Ma'lumotlar mavjud emas")
+    except Exception as e:
+        st.error(f"Platformalar xatolik: {e}")
 
-# ----------------------------
-# Client versions donut + legend
-# ----------------------------
-st.markdown(
-    """
+    # ----------------------------
+    # Client versions donut + legend
+    # ----------------------------
+    st.markdown(
+        """
 <div class="sec-row">
   <div>
     <div class="sec-title">🧩 Versiyalar</div>
-    <div class="sec-sub">O'yin versiyasi bo‘yicha foydalanuvchilar taqsimoti</div>
+    <div class="sec-sub">O'yin versiyasi bo‘yicha foydalanuvchilar taqsimoti (taxminiy, ≈ ±2%)</div>
   </div>
   <div></div>
 </div>
 """,
-    unsafe_allow_html=True,
-)
-
-try:
-    versions_df = run_query(f"""
-        SELECT
-            COALESCE(CLIENT_VERSION, 'Noma''lum') AS CLIENT_VERSION,
-            COUNT(DISTINCT USER_ID) AS USERS
-        FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE >= '2025-12-27'
-        GROUP BY COALESCE(CLIENT_VERSION, 'Noma''lum')
-        ORDER BY USERS DESC
-    """)
-
-    if not versions_df.empty:
-        total_v = int(versions_df["USERS"].sum())
-        versions_df["PERCENT"] = (versions_df["USERS"] / total_v * 100).round(1)
-
-        # Top N + Boshqalar (pie chiroyli ko‘rinishi uchun)
-        TOP_N = 8
-        if len(versions_df) > TOP_N:
-            top_df = versions_df.head(TOP_N).copy()
-            other_users = int(versions_df["USERS"].iloc[TOP_N:].sum())
-            other_percent = round(other_users / total_v * 100, 1)
-
-            top_df = pd.concat(
-                [
-                    top_df,
-                    pd.DataFrame([{
-                        "CLIENT_VERSION": "Boshqalar",
-                        "USERS": other_users,
-                        "PERCENT": other_percent
-                    }])
-                ],
-                ignore_index=True,
-            )
-            versions_df = top_df
-
-        # ✅ 1) Ranglar: chart + legend uchun bitta mapping
-        palette = [
-            "#2563EB", "#7C3AED", "#16A34A", "#F59E0B",
-            "#EF4444", "#06B6D4", "#F97316", "#0EA5E9",
-            "#A855F7", "#22C55E", "#EAB308", "#FB7185",
-        ]
-
-        domain = versions_df["CLIENT_VERSION"].tolist()
-
-        # "Boshqalar" va "Noma'lum" ni kulrang qilib qo'yamiz
-        fixed = {
-            "Boshqalar": COLORS["other"],
-            "Noma'lum": COLORS["other"],
-        }
-
-        # qolganlariga palette’dan rang taqsimlaymiz
-        color_map = {}
-        pi = 0
-        for v in domain:
-            if v in fixed:
-                color_map[v] = fixed[v]
-            else:
-                color_map[v] = palette[pi % len(palette)]
-                pi += 1
-
-        scale = alt.Scale(domain=domain, range=[color_map[v] for v in domain])
-
-        CHART_H = 300
-        c_chart, c_nums = st.columns([1.25, 0.85], gap="large", vertical_alignment="center")
+        unsafe_allow_html=True,
+    )
 
-        with c_chart:
-            pie = (
-                alt.Chart(versions_df)
-                .mark_arc(innerRadius=118, outerRadius=150, opacity=0.92)
-                .encode(
-                    theta=alt.Theta(field="USERS", type="quantitative"),
-                    color=alt.Color("CLIENT_VERSION:N", scale=scale, legend=None),
-                    tooltip=[
-                        alt.Tooltip("CLIENT_VERSION:N", title="Versiya"),
-                        alt.Tooltip("USERS:Q", title="Foydalanuvchilar", format=","),
-                        alt.Tooltip("PERCENT:Q", title="Ulush", format=".1f"),
+    try:
+        versions_df = section_results["versions"].result()
+        show_as_of(versions_df)
+
+        if not versions_df.empty:
+            total_v = int(versions_df["USERS"].sum())
+            versions_df["PERCENT"] = (versions_df["USERS"] / total_v * 100).round(1)
+
+            # Top N + Boshqalar (pie chiroyli ko‘rinishi uchun)
+            TOP_N = 8
+            if len(versions_df) > TOP_N:
+                top_df = versions_df.head(TOP_N).copy()
+                other_users = int(versions_df["USERS"].iloc[TOP_N:].sum())
+                other_percent = round(other_users / total_v * 100, 1)
+
+                top_df = pd.concat(
+                    [
+                        top_df,
+                        pd.DataFrame([{
+                            "CLIENT_VERSION": "Boshqalar",
+                            "USERS": other_users,
+                            "PERCENT": other_percent
+                        }])
                     ],
+                    ignore_index=True,
                 )
-                .properties(height=CHART_H, padding={"top": 6, "left": 8, "right": 8, "bottom": 8})
-            )
-            st.altair_chart(pie, width="stretch")
+                versions_df = top_df
+
+            # ✅ 1) Ranglar: chart + legend uchun bitta mapping
+            palette = [
+                "#2563EB", "#7C3AED", "#16A34A", "#F59E0B",
+                "#EF4444", "#06B6D4", "#F97316", "#0EA5E9",
+                "#A855F7", "#22C55E", "#EAB308", "#FB7185",
+            ]
+
+            domain = versions_df["CLIENT_VERSION"].tolist()
+
+            # "Boshqalar" va "Noma'lum" ni kulrang qilib qo'yamiz
+            fixed = {
+                "Boshqalar": COLORS["other"],
+                "Noma'lum": COLORS["other"],
+            }
+
+            # qolganlariga palette’dan rang taqsimlaymiz
+            color_map = {}
+            pi = 0
+            for v in domain:
+                if v in fixed:
+                    color_map[v] = fixed[v]
+                else:
+                    color_map[v] = palette[pi % len(palette)]
+                    pi += 1
+
+            scale = alt.Scale(domain=domain, range=[color_map[v] for v in domain])
+
+            CHART_H = 300
+            c_chart, c_nums = st.columns([1.25, 0.85], gap="large", vertical_alignment="center")
+
+            with c_chart:
+                pie = (
+                    alt.Chart(versions_df)
+                    .mark_arc(innerRadius=118, outerRadius=150, opacity=0.92)
+                    .encode(
+                        theta=alt.Theta(field="USERS", type="quantitative"),
+                        color=alt.Color("CLIENT_VERSION:N", scale=scale, legend=None),
+                        tooltip=[
+                            alt.Tooltip("CLIENT_VERSION:N", title="Versiya"),
+                            alt.Tooltip("USERS:Q", title="Foydalanuvchilar (≈)", format=","),
+                            alt.Tooltip("PERCENT:Q", title="Ulush", format=".1f"),
+                        ],
+                    )
+                    .properties(height=CHART_H, padding={"top": 6, "left": 8, "right": 8, "bottom": 8})
+                )
+                st.altair_chart(pie, width="stretch")
 
-        with c_nums:
-            legend_html = f'''
+            with c_nums:
+                legend_html = f'''
 <div class="stat-row">
   <div>
     <div class="stat-left"><span class="dot" style="background:{COLORS["accent"]};"></span>
       <span class="stat-label">Jami</span>
     </div>
   </div>
-  <div class="stat-right">{total_v:,}</div>
+  <div class="stat-right">≈{total_v:,}</div>
 </div>'''
 
-            for _, r in versions_df.iterrows():
-                v = r["CLIENT_VERSION"]
-                u = int(r["USERS"])
-                pr = float(r["PERCENT"])
-                dot_color = color_map.get(v, COLORS["other"])
+                for _, r in versions_df.iterrows():
+                    v = r["CLIENT_VERSION"]
+                    u = int(r["USERS"])
+                    pr = float(r["PERCENT"])
+                    dot_color = color_map.get(v, COLORS["other"])
 
-                legend_html += f'''
+                    legend_html += f'''
 <div class="stat-row">
   <div>
     <div class="stat-left"><span class="dot" style="background:{dot_color};"></span>
@@ -1259,578 +3255,506 @@ try:
     </div>
     <div class="stat-sub">{pr:.1f}%</div>
   </div>
-  <div class="stat-right">{u:,}</div>
+  <div class="stat-right">≈{u:,}</div>
 </div>'''
 
-            st.markdown(
-                f'<div class="legend-card card" style="background: #FFFFFF; border: 1px solid rgba(15,23,42,0.14); border-radius: 18px; padding: 16px; box-shadow: 0 10px 24px rgba(15,23,42,0.06);">{legend_html}</div>',
-                unsafe_allow_html=True,
-            )
+                st.markdown(
+                    f'<div class="legend-card card" style="background: #FFFFFF; border: 1px solid rgba(15,23,42,0.14); border-radius: 18px; padding: 16px; box-shadow: 0 10px 24px rgba(15,23,42,0.06);">{legend_html}</div>',
+                    unsafe_allow_html=True,
+                )
 
-    else:
-        st.info("Ma'lumotlar mavjud emas")
-except Exception as e:
-    st.error(f"Versiyalar xatolik: {e}")
+        else:
+            st.info("Ma'lumotlar mavjud emas")
+    except Exception as e:
+        st.error(f"Versiyalar xatolik: {e}")
+
+
+
+
+    # ----------------------------
+    # 2) New users
+    # ----------------------------
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('''<div class="sec-title">👥 Yangi foydalanuvchilar</div><div class="sec-sub">Tanlangan davr bo'yicha o'sish dinamikasi</div>''', unsafe_allow_html=True)
+    with right:
+        f1, f2 = st.columns([0.9, 1.1], gap="small")
+        with f1:
+            period_type = st.selectbox("Kesim", ["Kunlik", "Haftalik", "Oylik"], key="new_users_period")
+        with f2:
+            date_range = st.date_input(
+                "Sana oralig'i",
+                value=NEW_USERS_DEFAULT_RANGE,
+                key="new_users_date",
+            )
 
+    if len(date_range) == 2:
+        try:
+            new_users_df = section_results["new_users"].result()
+            show_as_of(new_users_df)
 
+            if not new_users_df.empty:
+                new_users_df["SANA"] = pd.to_datetime(new_users_df["SANA"])
+                new_users_df["SANA_STR"] = new_users_df["SANA"].dt.strftime("%Y-%m-%d")
 
+                m1, m2, m3 = st.columns(3)
+                m1.metric("Jami", f"{int(new_users_df['YANGI_USERS'].sum()):,}")
+                m2.metric("Eng yuqori", f"{int(new_users_df['YANGI_USERS'].max()):,}")
+                m3.metric("O'rtacha", f"{int(round(new_users_df['YANGI_USERS'].mean(), 0)):,}")
+            
+                chart = (
+                    alt.Chart(new_users_df)
+                    .mark_bar(color=COLORS["new_users"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
+                    .encode(
+                        x=alt.X("SANA_STR:O", title="", axis=alt.Axis(labelAngle=-30, labelFontWeight=600), sort=None),
+                        y=alt.Y("YANGI_USERS:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                        tooltip=[
+                            alt.Tooltip("SANA_STR:O", title="Sana"),
+                            alt.Tooltip("YANGI_USERS:Q", title="Yangi", format=","),
+                        ],
+                    )
+                    .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
+                )
+                st.altair_chart(chart, width="stretch")
+            else:
+                st.info("Tanlangan davr uchun ma'lumotlar mavjud emas")
+        except Exception as e:
+            st.error(f"Yangi foydalanuvchilar xatolik: {e}")
+
+    # ----------------------------
+    # 3) Sessions
+    # ----------------------------
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('''<div class="sec-title">📈 O'yin seanslari</div><div class="sec-sub">Faollik ko'rinishi</div>''', unsafe_allow_html=True)
+    with right:
+        s1, s2 = st.columns([0.9, 1.1], gap="small")
+        with s1:
+            session_view = st.selectbox("Ko'rinish", ["Kunlik", "Soatlik"], key="session_view")
+        with s2:
+            if session_view == "Soatlik":
+                session_date = st.date_input("Sana", value=local_today, key="session_date")
+                session_period = None
+            else:
+                session_period = st.selectbox(
+                    "Davr",
+                    ["Hammasi", "So'nggi 7 kun", "So'nggi 14 kun", "So'nggi 30 kun"],
+                    key="session_period",
+                )
+                session_date = None
 
-# ----------------------------
-# 2) New users
-# ----------------------------
-left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
-with left:
-    st.markdown('''<div class="sec-title">👥 Yangi foydalanuvchilar</div><div class="sec-sub">Tanlangan davr bo'yicha o'sish dinamikasi</div>''', unsafe_allow_html=True)
-with right:
-    f1, f2 = st.columns([0.9, 1.1], gap="small")
-    with f1:
-        period_type = st.selectbox("Kesim", ["Kunlik", "Haftalik", "Oylik"], key="new_users_period")
-    with f2:
-        date_range = st.date_input(
-            "Sana oralig'i",
-            value=(datetime(2025, 12, 27).date(), datetime.now().date()),
-            key="new_users_date",
+    try:
+        if session_view == "Soatlik":
+            sessions_df = section_results["sessions"].result()
+            show_as_of(sessions_df)
+
+            if not sessions_df.empty:
+                sessions_df["SOAT"] = pd.to_numeric(sessions_df["SOAT"], errors="coerce").fillna(0).astype(int)
+                sessions_df["HODISALAR"] = pd.to_numeric(sessions_df["HODISALAR"], errors="coerce").fillna(0).astype(int)
+                sessions_df["FOYDALANUVCHILAR"] = pd.to_numeric(sessions_df["FOYDALANUVCHILAR"], errors="coerce").fillna(0).astype(int)
+                sessions_df["SOAT_LABEL"] = sessions_df["SOAT"].apply(lambda x: f"{x:02d}:00")
+
+                m1, m2 = st.columns(2)
+                m1.metric("Hodisalar", f"{int(sessions_df['HODISALAR'].sum()):,}")
+                m2.metric("Faol foydalanuvchilar", f"{int(sessions_df['FOYDALANUVCHILAR'].sum()):,}")
+
+                chart = (
+                    alt.Chart(sessions_df)
+                    .mark_bar(color=COLORS["sessions"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
+                    .encode(
+                        x=alt.X("SOAT_LABEL:N", title="", sort=None, axis=alt.Axis(labelAngle=0, labelFontWeight=600)),
+                        y=alt.Y("HODISALAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                        tooltip=[
+                            alt.Tooltip("SOAT_LABEL:N", title="Soat"),
+                            alt.Tooltip("HODISALAR:Q", title="Hodisalar", format=","),
+                            alt.Tooltip("FOYDALANUVCHILAR:Q", title="Foydalanuvchilar", format=","),
+                        ],
+                    )
+                    .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
+                )
+                st.altair_chart(chart, width="stretch")
+            else:
+                st.info("Tanlangan sana uchun ma'lumotlar mavjud emas")
+        else:
+            # Kunlik ko'rinish uchun
+            sessions_df = section_results["sessions"].result()
+            show_as_of(sessions_df)
+
+            if not sessions_df.empty:
+                m1, m2, m3 = st.columns(3)
+                m1.metric("Jami", f"{int(sessions_df['SESSIYALAR'].sum()):,}")
+                m2.metric("O'rtacha kunlik", f"{int(sessions_df['SESSIYALAR'].mean()):,}")
+                m3.metric("O'rtacha o'yin davomiyligi (daq)", f"{round(float(sessions_df['ORTACHA_DAVOMIYLIK'].mean()), 1)}")
+
+                sessions_df["SANA"] = pd.to_datetime(sessions_df["SANA"])
+                sessions_df["SANA_STR"] = sessions_df["SANA"].dt.strftime("%Y-%m-%d")
+
+                chart = (
+                    alt.Chart(sessions_df)
+                    .mark_bar(color=COLORS["sessions"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
+                    .encode(
+                        x=alt.X("SANA_STR:O", title="", axis=alt.Axis(labelAngle=-30, labelFontWeight=600), sort=None),
+                        y=alt.Y("SESSIYALAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                        tooltip=[
+                            alt.Tooltip("SANA_STR:O", title="Sana"),
+                            alt.Tooltip("SESSIYALAR:Q", title="Sessiyalar", format=","),
+                            alt.Tooltip("ORTACHA_DAVOMIYLIK:Q", title="Daqiqa", format=".1f"),
+                        ],
+                    )
+                    .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
+                )
+                st.altair_chart(chart, width="stretch")
+            else:
+                st.info("Ma'lumotlar mavjud emas")
+    except Exception as e:
+        st.error(f"Sessiyalar xatolik: {e}")
+
+
+    # ----------------------------
+    # 4) DAU Trend
+    # ----------------------------
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('<div class="sec-title">📊 Kunlik faol foydalanuvchilar (DAU)</div><div class="sec-sub">Har kungi unikal foydalanuvchilar soni va 7 kunlik faollar (WAU)</div>', unsafe_allow_html=True)
+    with right:
+        dau_period = st.selectbox(
+            "Davr",
+            ["So'nggi 7 kun", "So'nggi 14 kun", "So'nggi 30 kun", "So'nggi 90 kun"],
+            key="dau_period",
         )
 
-if len(date_range) == 2:
-    start_date, end_date = date_range
-    
-    # Har doim 27-dekabrdan boshlanadi
-    min_date = datetime(2025, 12, 27).date()
-    if start_date < min_date:
-        start_date = min_date
-    
-    start_str = start_date.strftime("%Y-%m-%d")
-    end_adjusted = end_date + timedelta(days=1)
-    end_str = end_adjusted.strftime("%Y-%m-%d")
-
     try:
-        if period_type == "Kunlik":
-            new_users_df = run_query(f"""
-                SELECT
-                    PLAYER_START_DATE as SANA,
-                    COUNT(DISTINCT USER_ID) as YANGI_USERS
-                FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-                WHERE GAME_ID = {GAME_ID}
-                AND PLAYER_START_DATE >= '{start_str}' AND PLAYER_START_DATE < '{end_str}'
-                GROUP BY PLAYER_START_DATE
-                ORDER BY PLAYER_START_DATE
-            """)
-        elif period_type == "Haftalik":
-            new_users_df = run_query(f"""
-                SELECT
-                    DATE_TRUNC('week', PLAYER_START_DATE) as SANA,
-                    COUNT(DISTINCT USER_ID) as YANGI_USERS
-                FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-                WHERE GAME_ID = {GAME_ID}
-                AND PLAYER_START_DATE >= '{start_str}' AND PLAYER_START_DATE < '{end_str}'
-                GROUP BY DATE_TRUNC('week', PLAYER_START_DATE)
-                ORDER BY SANA
-            """)
-        else:
-            new_users_df = run_query(f"""
-                SELECT
-                    DATE_TRUNC('month', PLAYER_START_DATE) as SANA,
-                    COUNT(DISTINCT USER_ID) as YANGI_USERS
-                FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-                WHERE GAME_ID = {GAME_ID}
-                AND PLAYER_START_DATE >= '{start_str}' AND PLAYER_START_DATE < '{end_str}'
-                GROUP BY DATE_TRUNC('month', PLAYER_START_DATE)
-                ORDER BY SANA
-            """)
-
-        if not new_users_df.empty:
-            new_users_df["SANA"] = pd.to_datetime(new_users_df["SANA"])
-            new_users_df["SANA_STR"] = new_users_df["SANA"].dt.strftime("%Y-%m-%d")
+        dau_trend_df = section_results["dau_trend"].result()
+        show_as_of(dau_trend_df)
+        if not dau_trend_df.empty:
+            dau_trend_df["SANA"] = pd.to_datetime(dau_trend_df["SANA"])
+            dau_trend_df["SANA_STR"] = dau_trend_df["SANA"].dt.strftime("%Y-%m-%d")
+
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("O'rtacha DAU", f"{int(dau_trend_df['DAU'].mean()):,}")
+            m2.metric("Eng yuqori", f"{int(dau_trend_df['DAU'].max()):,}")
+            m3.metric("Eng past", f"{int(dau_trend_df['DAU'].min()):,}")
+            m4.metric("DAU/MAU", f"{dau_trend_df['YOPISHQOQLIK'].mean():.1f}%", help="Yopishqoqlik: kunlik faollarning so'nggi 30 kunlik faollarga nisbati")
+
+            # Davrga qarab tickCount ni sozlash
+            tick_count = 5 if dau_period == "So'nggi 90 kun" else 7
+
+            # Area chart for DAU: Bold labels, no grid
+            dau_area = (
+                alt.Chart(dau_trend_df)
+                .mark_area(
+                    color=COLORS["sessions"],
+                    opacity=0.2,
+                    line=False
+                )
+                .encode(
+                    x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=tick_count, labelFontWeight=600)),
+                    y=alt.Y("DAU:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                )
+            )
 
-            m1, m2, m3 = st.columns(3)
-            m1.metric("Jami", f"{int(new_users_df['YANGI_USERS'].sum()):,}")
-            m2.metric("Eng yuqori", f"{int(new_users_df['YANGI_USERS'].max()):,}")
-            m3.metric("O'rtacha", f"{int(round(new_users_df['YANGI_USERS'].mean(), 0)):,}")
-            
-            chart = (
-                alt.Chart(new_users_df)
-                .mark_bar(color=COLORS["new_users"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
+            dau_line = (
+                alt.Chart(dau_trend_df)
+                .mark_line(color=COLORS["sessions"], strokeWidth=2.6, opacity=0.9)
                 .encode(
-                    x=alt.X("SANA_STR:O", title="", axis=alt.Axis(labelAngle=-30, labelFontWeight=600), sort=None),
-                    y=alt.Y("YANGI_USERS:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                    x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=tick_count, labelFontWeight=600)),
+                    y=alt.Y("DAU:Q", title="", axis=alt.Axis(labelFontWeight=600)),
                     tooltip=[
-                        alt.Tooltip("SANA_STR:O", title="Sana"),
-                        alt.Tooltip("YANGI_USERS:Q", title="Yangi", format=","),
+                        alt.Tooltip("SANA:T", title="Sana", format="%Y-%m-%d"),
+                        alt.Tooltip("DAU:Q", title="DAU", format=","),
+                        alt.Tooltip("WAU:Q", title="WAU (7 kun)", format=","),
+                        alt.Tooltip("MAU:Q", title="MAU (30 kun)", format=","),
+                        alt.Tooltip("YOPISHQOQLIK:Q", title="DAU/MAU, %", format=".1f"),
                     ],
                 )
-                .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
-            )
-            st.altair_chart(chart, width="stretch")
-        else:
-            st.info("Tanlangan davr uchun ma'lumotlar mavjud emas")
-    except Exception as e:
-        st.error(f"Yangi foydalanuvchilar xatolik: {e}")
-
-# ----------------------------
-# 3) Sessions
-# ----------------------------
-left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
-with left:
-    st.markdown('''<div class="sec-title">📈 O'yin seanslari</div><div class="sec-sub">Faollik ko'rinishi</div>''', unsafe_allow_html=True)
-with right:
-    s1, s2 = st.columns([0.9, 1.1], gap="small")
-    with s1:
-        session_view = st.selectbox("Ko'rinish", ["Kunlik", "Soatlik"], key="session_view")
-    with s2:
-        if session_view == "Soatlik":
-            session_date = st.date_input("Sana", value=datetime.now().date(), key="session_date")
-            session_period = None
-        else:
-            session_period = st.selectbox(
-                "Davr",
-                ["Hammasi", "So'nggi 7 kun", "So'nggi 14 kun", "So'nggi 30 kun"],
-                key="session_period",
             )
-            session_date = None
 
-try:
-    if session_view == "Soatlik":
-        date_str = session_date.strftime("%Y-%m-%d")
-        sessions_df = run_query(f"""
-            SELECT
-                HOUR(DATEADD(hour, 5, EVENT_TIMESTAMP)) as SOAT,
-                COUNT(*) as HODISALAR,
-                COUNT(DISTINCT USER_ID) as FOYDALANUVCHILAR
-            FROM {DB}.ACCOUNT_EVENTS
-            WHERE GAME_ID = {GAME_ID}
-            AND DATE(EVENT_TIMESTAMP) = '{date_str}'
-            GROUP BY HOUR(DATEADD(hour, 5, EVENT_TIMESTAMP))
-            ORDER BY SOAT
-        """)
-
-        if not sessions_df.empty:
-            sessions_df["SOAT"] = pd.to_numeric(sessions_df["SOAT"], errors="coerce").fillna(0).astype(int)
-            sessions_df["HODISALAR"] = pd.to_numeric(sessions_df["HODISALAR"], errors="coerce").fillna(0).astype(int)
-            sessions_df["FOYDALANUVCHILAR"] = pd.to_numeric(sessions_df["FOYDALANUVCHILAR"], errors="coerce").fillna(0).astype(int)
-            sessions_df["SOAT_LABEL"] = sessions_df["SOAT"].apply(lambda x: f"{x:02d}:00")
-
-            m1, m2 = st.columns(2)
-            m1.metric("Hodisalar", f"{int(sessions_df['HODISALAR'].sum()):,}")
-            m2.metric("Faol foydalanuvchilar", f"{int(sessions_df['FOYDALANUVCHILAR'].sum()):,}")
-
-            chart = (
-                alt.Chart(sessions_df)
-                .mark_bar(color=COLORS["sessions"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
+            # Rolling 7-day WAU as a dashed line over the same axis
+            wau_line = (
+                alt.Chart(dau_trend_df)
+                .mark_line(color=COLORS["sessions"], strokeWidth=2, strokeDash=[6, 4], opacity=0.6)
                 .encode(
-                    x=alt.X("SOAT_LABEL:N", title="", sort=None, axis=alt.Axis(labelAngle=0, labelFontWeight=600)),
-                    y=alt.Y("HODISALAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                    x="SANA:T",
+                    y="WAU:Q",
                     tooltip=[
-                        alt.Tooltip("SOAT_LABEL:N", title="Soat"),
-                        alt.Tooltip("HODISALAR:Q", title="Hodisalar", format=","),
-                        alt.Tooltip("FOYDALANUVCHILAR:Q", title="Foydalanuvchilar", format=","),
+                        alt.Tooltip("SANA:T", title="Sana", format="%Y-%m-%d"),
+                        alt.Tooltip("WAU:Q", title="WAU (7 kun)", format=","),
                     ],
                 )
-                .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
             )
-            st.altair_chart(chart, width="stretch")
-        else:
-            st.info("Tanlangan sana uchun ma'lumotlar mavjud emas")
-    else:
-        # Kunlik ko'rinish uchun
-        if session_period == "Hammasi":
-            start_date = datetime(2025, 12, 27)
-            end_date = datetime.now()  # Hozirgi vaqt
+
+            dau_points = (
+                alt.Chart(dau_trend_df)
+                .mark_circle(size=60, color=COLORS["sessions"], opacity=0.85)
+                .encode(x="SANA:T", y="DAU:Q")
+            )
+
+            st.altair_chart((dau_area + wau_line + dau_line + dau_points).properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8}), use_container_width=True)
         else:
-            days_map = {"So'nggi 7 kun": 7, "So'nggi 14 kun": 14, "So'nggi 30 kun": 30}
-            days = days_map[session_period]
-            end_date = datetime.now()  # Hozirgi vaqt
-            start_date = end_date - timedelta(days=days)
+            st.info("Ma'lumotlar mavjud emas")
+    except Exception as e:
+        st.error(f"DAU trend xatolik: {e}")
+
+    # ----------------------------
+    # 5) MAU Trend
+    # ----------------------------
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('<div class="sec-title">📅 Oylik faol foydalanuvchilar (MAU)</div><div class="sec-sub">Har oylik unikal foydalanuvchilar soni</div>', unsafe_allow_html=True)
+    with right:
+        mau_period = st.selectbox(
+            "Davr",
+            ["So'nggi 6 oy", "So'nggi 12 oy"],
+            key="mau_period",
+        )
 
-        sessions_df = run_query(f"""
-            SELECT
-                EVENT_DATE as SANA,
-                COUNT(DISTINCT SESSION_ID) as SESSIYALAR,
-                ROUND(AVG(TOTAL_TIME_MS) / 60000, 1) as ORTACHA_DAVOMIYLIK
-            FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-            WHERE GAME_ID = {GAME_ID}
-            AND EVENT_DATE BETWEEN '{start_date.strftime("%Y-%m-%d")}' AND '{end_date.strftime("%Y-%m-%d")}'
-            GROUP BY EVENT_DATE
-            ORDER BY EVENT_DATE
-        """)
-
-        if not sessions_df.empty:
-            m1, m2, m3 = st.columns(3)
-            m1.metric("Jami", f"{int(sessions_df['SESSIYALAR'].sum()):,}")
-            m2.metric("O'rtacha kunlik", f"{int(sessions_df['SESSIYALAR'].mean()):,}")
-            m3.metric("O'rtacha o'yin davomiyligi (daq)", f"{round(float(sessions_df['ORTACHA_DAVOMIYLIK'].mean()), 1)}")
+    try:
+        mau_month_dfs = [section_results[key].result() for key in mau_month_keys]
+        show_as_of(*mau_month_dfs)
+        mau_trend_df = pd.concat(mau_month_dfs, ignore_index=True)
+        mau_trend_df = mau_trend_df[mau_trend_df["MAU"] > 0]
+
+        if not mau_trend_df.empty:
+            mau_trend_df["OY"] = pd.to_datetime(mau_trend_df["OY"])
+            mau_trend_df["OY"] = pd.to_datetime(mau_trend_df["OY"])
+
+            MONTHS_UZ = {
+                1: "Yanvar", 2: "Fevral", 3: "Mart", 4: "Aprel",
+                5: "May", 6: "Iyun", 7: "Iyul", 8: "Avgust",
+                9: "Sentabr", 10: "Oktabr", 11: "Noyabr", 12: "Dekabr"
+            }
+
+            mau_trend_df["OY_LABEL"] = mau_trend_df["OY"].apply(
+                lambda d: f"{d.year}-{MONTHS_UZ[d.month]}"
+            )
 
-            sessions_df["SANA"] = pd.to_datetime(sessions_df["SANA"])
-            sessions_df["SANA_STR"] = sessions_df["SANA"].dt.strftime("%Y-%m-%d")
+            m1, m2, m3 = st.columns(3)
+            m1.metric("O'rtacha MAU", f"{int(mau_trend_df['MAU'].mean()):,}")
+            m2.metric("Eng yuqori", f"{int(mau_trend_df['MAU'].max()):,}")
+            m3.metric("Oxirgi oy", f"{int(mau_trend_df['MAU'].iloc[-1]):,}")
 
-            chart = (
-                alt.Chart(sessions_df)
-                .mark_bar(color=COLORS["sessions"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
+            mau_chart = (
+                alt.Chart(mau_trend_df)
+                .mark_bar(color=COLORS["purple"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
                 .encode(
-                    x=alt.X("SANA_STR:O", title="", axis=alt.Axis(labelAngle=-30, labelFontWeight=600), sort=None),
-                    y=alt.Y("SESSIYALAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
-                    tooltip=[
-                        alt.Tooltip("SANA_STR:O", title="Sana"),
-                        alt.Tooltip("SESSIYALAR:Q", title="Sessiyalar", format=","),
-                        alt.Tooltip("ORTACHA_DAVOMIYLIK:Q", title="Daqiqa", format=".1f"),
+                   x=alt.X("OY_LABEL:O", title="", axis=alt.Axis(labelAngle=-30, labelFontWeight=600), sort=None),
+                   y=alt.Y("MAU:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                   tooltip=[
+                        alt.Tooltip("OY_LABEL:O", title="Yil-Oy"),
+                        alt.Tooltip("MAU:Q", title="MAU", format=","),
+                        alt.Tooltip("QOLGANLAR:Q", title="Oldingi oydan qolganlar", format=","),
                     ],
-                )
+        )
+        .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
                 .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
             )
-            st.altair_chart(chart, width="stretch")
+            st.altair_chart(mau_chart, use_container_width=True)
         else:
             st.info("Ma'lumotlar mavjud emas")
-except Exception as e:
-    st.error(f"Sessiyalar xatolik: {e}")
-
-
-# ----------------------------
-# 4) DAU Trend
-# ----------------------------
-left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
-with left:
-    st.markdown('<div class="sec-title">📊 Kunlik faol foydalanuvchilar (DAU)</div><div class="sec-sub">Har kungi unikal foydalanuvchilar soni</div>', unsafe_allow_html=True)
-with right:
-    dau_period = st.selectbox(
-        "Davr",
-        ["So'nggi 7 kun", "So'nggi 14 kun", "So'nggi 30 kun", "So'nggi 90 kun"],
-        key="dau_period",
-    )
-
-try:
-    dau_days_map = {"So'nggi 7 kun": 7, "So'nggi 14 kun": 14, "So'nggi 30 kun": 30, "So'nggi 90 kun": 90}
-    dau_days = dau_days_map[dau_period]
-
-    # Set end date to yesterday instead of today
-    dau_end = datetime.now() - timedelta(days=1)
-
-    # Set custom start date for 90 days option
-    if dau_period == "So'nggi 90 kun":
-        dau_start = datetime(2025, 12, 27)
-    else:
-        dau_start = dau_end - timedelta(days=dau_days)
-
-    dau_trend_df = run_query(f"""
-        SELECT
-            EVENT_DATE as SANA,
-            COUNT(DISTINCT USER_ID) as DAU
-        FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE BETWEEN '{dau_start.strftime("%Y-%m-%d")}' AND '{dau_end.strftime("%Y-%m-%d")}'
-        GROUP BY EVENT_DATE
-        ORDER BY EVENT_DATE
-    """)
-    if not dau_trend_df.empty:
-        dau_trend_df["SANA"] = pd.to_datetime(dau_trend_df["SANA"])
-        dau_trend_df["SANA_STR"] = dau_trend_df["SANA"].dt.strftime("%Y-%m-%d")
-
-        m1, m2, m3 = st.columns(3)
-        m1.metric("O'rtacha DAU", f"{int(dau_trend_df['DAU'].mean()):,}")
-        m2.metric("Eng yuqori", f"{int(dau_trend_df['DAU'].max()):,}")
-        m3.metric("Eng past", f"{int(dau_trend_df['DAU'].min()):,}")
-
-        # Davrga qarab tickCount ni sozlash
-        tick_count = 5 if dau_period == "So'nggi 90 kun" else 7
-
-        # Area chart for DAU: Bold labels, no grid
-        dau_area = (
-            alt.Chart(dau_trend_df)
-            .mark_area(
-                color=COLORS["sessions"],
-                opacity=0.2,
-                line=False
-            )
-            .encode(
-                x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=tick_count, labelFontWeight=600)),
-                y=alt.Y("DAU:Q", title="", axis=alt.Axis(labelFontWeight=600)),
-            )
-        )
-
-        dau_line = (
-            alt.Chart(dau_trend_df)
-            .mark_line(color=COLORS["sessions"], strokeWidth=2.6, opacity=0.9)
-            .encode(
-                x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=tick_count, labelFontWeight=600)),
-                y=alt.Y("DAU:Q", title="", axis=alt.Axis(labelFontWeight=600)),
-                tooltip=[
-                    alt.Tooltip("SANA:T", title="Sana", format="%Y-%m-%d"),
-                    alt.Tooltip("DAU:Q", title="DAU", format=","),
-                ],
+    except Exception as e:
+        st.error(f"MAU trend xatolik: {e}")
+
+    # Mini games trends
+
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('''<div class="sec-title">🎮 Mini o'yinlar trendi</div><div class="sec-sub">Tanlangan mini-o'yin va davr bo'yicha o'yinga kirishlar soni</div>''', unsafe_allow_html=True)
+    with right:
+        m1, m2 = st.columns([1.2, 1], gap="small")
+        with m1:
+            st.markdown('<div style="font-size: 14px; font-weight: 500; margin-bottom: 4px;">Davr</div>', unsafe_allow_html=True)
+            mg_date_range = st.date_input(
+                "Sana oralig'i",
+                value=MG_DEFAULT_RANGE,
+                key="mg_date",
+                label_visibility="collapsed"
             )
-        )
-
-        dau_points = (
-            alt.Chart(dau_trend_df)
-            .mark_circle(size=60, color=COLORS["sessions"], opacity=0.85)
-            .encode(x="SANA:T", y="DAU:Q")
-        )
-
-        st.altair_chart((dau_area + dau_line + dau_points).properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8}), use_container_width=True)
-    else:
-        st.info("Ma'lumotlar mavjud emas")
-except Exception as e:
-    st.error(f"DAU trend xatolik: {e}")
-
-# ----------------------------
-# 5) MAU Trend
-# ----------------------------
-left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
-with left:
-    st.markdown('<div class="sec-title">📅 Oylik faol foydalanuvchilar (MAU)</div><div class="sec-sub">Har oylik unikal foydalanuvchilar soni</div>', unsafe_allow_html=True)
-with right:
-    mau_period = st.selectbox(
-        "Davr",
-        ["So'nggi 6 oy", "So'nggi 12 oy"],
-        key="mau_period",
-    )
-
-try:
-    mau_months_map = {"So'nggi 6 oy": 6, "So'nggi 12 oy": 12}
-    mau_months = mau_months_map[mau_period]
-    mau_end = datetime.now()
-    mau_start = mau_end - timedelta(days=mau_months * 30)
-
-    # Release bolgan vaqtdan boshlab analiz qilsin
-    min_date = datetime(2025, 12, 27)
-    if mau_start < min_date:
-        mau_start = min_date
+        with m2:
+            st.markdown('<div style="font-size: 14px; font-weight: 500; margin-bottom: 4px;">Mini o\'yin</div>', unsafe_allow_html=True)
+            try:
+                mg_list = section_results["mg_list"].result()
+                mg_options = ["Barchasi"] + [get_minigame_name(mg) for mg in mg_list["MINI_GAME"].tolist() if mg]
+                selected_mg = st.selectbox("Mini o'yin", mg_options, key="mg_filter", label_visibility="collapsed")
+            except Exception:
+                selected_mg = "Barchasi"
 
+    if len(mg_date_range) == 2:
+        try:
+            mg_stats = section_results["mg_trend"].result()
+            show_as_of(mg_stats)
+
+            if not mg_stats.empty:
+                mg_stats["SANA"] = pd.to_datetime(mg_stats["SANA"])
+
+                # Shaded area
+                area = (
+                    alt.Chart(mg_stats)
+                    .mark_area(
+                        color=COLORS["minigame"],
+                        opacity=0.2,
+                        line=False
+                    )
+                    .encode(
+                        x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=5, labelFontWeight=600)),
+                        y=alt.Y("OYINLAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                    )
+                )
+            
+                # Line
+                line = (
+                    alt.Chart(mg_stats)
+                    .mark_line(color=COLORS["minigame"], strokeWidth=2.6, opacity=0.9)
+                    .encode(
+                        x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=10, labelFontWeight=600)),
+                        y=alt.Y("OYINLAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                        tooltip=[
+                            alt.Tooltip("SANA:T", title="Sana", format="%Y-%m-%d"),
+                            alt.Tooltip("OYINLAR:Q", title="O'yinlar", format=","),
+                            alt.Tooltip("OYINCHILAR:Q", title="O'yinchilar", format=","),
+                        ],
+                    )
+                )
+            
+                # Points
+                points = (
+                    alt.Chart(mg_stats)
+                    .mark_circle(size=60, color=COLORS["minigame"], opacity=0.85)
+                    .encode(x="SANA:T", y="OYINLAR:Q")
+                )
 
-    mau_trend_df = run_query(f"""
-        SELECT
-            DATE_TRUNC('month', EVENT_DATE) as OY,
-            COUNT(DISTINCT USER_ID) as MAU
-        FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-        WHERE GAME_ID = {GAME_ID}
-        AND EVENT_DATE BETWEEN '{mau_start.strftime("%Y-%m-%d")}' AND '{mau_end.strftime("%Y-%m-%d")}'
-        GROUP BY DATE_TRUNC('month', EVENT_DATE)
-        ORDER BY OY
-    """)
-
-    if not mau_trend_df.empty:
-        mau_trend_df["OY"] = pd.to_datetime(mau_trend_df["OY"])
-        mau_trend_df["OY"] = pd.to_datetime(mau_trend_df["OY"])
-
-        MONTHS_UZ = {
-            1: "Yanvar", 2: "Fevral", 3: "Mart", 4: "Aprel",
-            5: "May", 6: "Iyun", 7: "Iyul", 8: "Avgust",
-            9: "Sentabr", 10: "Oktabr", 11: "Noyabr", 12: "Dekabr"
-        }
+                st.altair_chart((area + line + points).properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8}), width="stretch")
+            else:
+                st.info("Tanlangan davr uchun ma'lumotlar mavjud emas")
+        except Exception as e:
+            st.error(f"Mini oyinlar trendi xatolik: {e}")
 
-        mau_trend_df["OY_LABEL"] = mau_trend_df["OY"].apply(
-            lambda d: f"{d.year}-{MONTHS_UZ[d.month]}"
-        )
 
-        m1, m2, m3 = st.columns(3)
-        m1.metric("O'rtacha MAU", f"{int(mau_trend_df['MAU'].mean()):,}")
-        m2.metric("Eng yuqori", f"{int(mau_trend_df['MAU'].max()):,}")
-        m3.metric("Oxirgi oy", f"{int(mau_trend_df['MAU'].iloc[-1]):,}")
-
-        mau_chart = (
-            alt.Chart(mau_trend_df)
-            .mark_bar(color=COLORS["purple"], cornerRadiusTopLeft=6, cornerRadiusTopRight=6, opacity=0.92)
-            .encode(
-               x=alt.X("OY_LABEL:O", title="", axis=alt.Axis(labelAngle=-30, labelFontWeight=600), sort=None),
-               y=alt.Y("MAU:Q", title="", axis=alt.Axis(labelFontWeight=600)),
-               tooltip=[
-                    alt.Tooltip("OY_LABEL:O", title="Yil-Oy"),
-                    alt.Tooltip("MAU:Q", title="MAU", format=","),
-                ],
-    )
-    .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
-            .properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
-        )
-        st.altair_chart(mau_chart, use_container_width=True)
-    else:
-        st.info("Ma'lumotlar mavjud emas")
-except Exception as e:
-    st.error(f"MAU trend xatolik: {e}")
-
-# Mini games trends
-
-left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
-with left:
-    st.markdown('''<div class="sec-title">🎮 Mini o'yinlar trendi</div><div class="sec-sub">Tanlangan mini-o'yin va davr bo'yicha o'yinga kirishlar soni</div>''', unsafe_allow_html=True)
-with right:
-    m1, m2 = st.columns([1.2, 1], gap="small")
-    with m1:
-        st.markdown('<div style="font-size: 14px; font-weight: 500; margin-bottom: 4px;">Davr</div>', unsafe_allow_html=True)
-        mg_date_range = st.date_input(
-            "Sana oralig'i",
-            value=(datetime.now().date() - timedelta(days=30), datetime.now().date()),
-            key="mg_date",
-            label_visibility="collapsed"
-        )
-    with m2:
-        st.markdown('<div style="font-size: 14px; font-weight: 500; margin-bottom: 4px;">Mini o\'yin</div>', unsafe_allow_html=True)
-        try:
-            mg_list = run_query(f"""
-                SELECT DISTINCT EVENT_JSON:MiniGameName::STRING as MINI_GAME
-                FROM {DB}.ACCOUNT_EVENTS
-                WHERE GAME_ID = {GAME_ID} AND EVENT_NAME = 'playedMiniGameStatus'
-                AND EVENT_JSON:MiniGameName::STRING IS NOT NULL
-            """)
-            mg_options = ["Barchasi"] + [get_minigame_name(mg) for mg in mg_list["MINI_GAME"].tolist() if mg]
-            mg_original = {get_minigame_name(mg): mg for mg in mg_list["MINI_GAME"].tolist() if mg}
-            selected_mg = st.selectbox("Mini o'yin", mg_options, key="mg_filter", label_visibility="collapsed")
-        except Exception:
-            selected_mg = "Barchasi"
-            mg_original = {}
+    # ----------------------------
+    # 7) Top 5 mini-games
+    # ----------------------------
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('''<div class="sec-title">🏆 TOP 5 mini o'yin</div><div class="sec-sub">Eng ko'p o'yinchi to'plaganlar</div>''', unsafe_allow_html=True)
+    with right:
+        st.selectbox("Davr", ["Hammasi", *TOP_GAMES_PERIOD_DAYS], key="top_games_period")
 
-if len(mg_date_range) == 2:
-    mg_start, mg_end = mg_date_range
-    min_date = datetime(2025, 12, 27).date()
-    if mg_start < min_date:
-        mg_start = min_date
+    try:
+        top_games = section_results["top_games"].result()
+        show_as_of(top_games)
+
+        if not top_games.empty:
+            top_games["NOMI"] = top_games["MINI_GAME"].apply(get_minigame_name)
+            medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
+
+            # Build all rows as single HTML block
+            rows_html = ""
+            for i, row in top_games.reset_index(drop=True).iterrows():
+                medal = medals[i] if i < len(medals) else f"#{i+1}"
+                rows_html += f'''
+<div class="rank-row">
+  <div class="rank-badge">{medal}</div>
+  <div class="rank-name">{row["NOMI"]}<div class="rank-sub">{int(row["OYINLAR"]):,} o'yin · {row["OYIN_PER_OYINCHI"]:.1f} o'yin/o'yinchi · p50 {row["P50"]:g} · p90 {row["P90"]:g}</div></div>
+  <div class="rank-val">{int(row["OYINCHILAR"]):,}</div>
+</div>'''
 
-    mg_start_str = mg_start.strftime("%Y-%m-%d")
-    mg_end_adjusted = mg_end + timedelta(days=1)
-    mg_end_str = mg_end_adjusted.strftime("%Y-%m-%d")
+            st.markdown(f'<div class="rank-card card" style="margin-bottom: 16px;">{rows_html}</div>', unsafe_allow_html=True)
 
-    try:
-        if selected_mg == "Barchasi":
-            mg_stats = run_query(f"""
-                SELECT
-                    DATE(EVENT_TIMESTAMP) as SANA,
-                    COUNT(*) as OYINLAR
-                FROM {DB}.ACCOUNT_EVENTS
-                WHERE GAME_ID = {GAME_ID}
-                AND EVENT_NAME = 'playedMiniGameStatus'
-                AND EVENT_TIMESTAMP >= '{mg_start_str}' AND EVENT_TIMESTAMP < '{mg_end_str}'
-                GROUP BY DATE(EVENT_TIMESTAMP)
-                ORDER BY SANA
-            """)
-        else:
-            original_name = mg_original.get(selected_mg, selected_mg)
-            mg_stats = run_query(f"""
-                SELECT
-                    DATE(EVENT_TIMESTAMP) as SANA,
-                    COUNT(*) as OYINLAR
-                FROM {DB}.ACCOUNT_EVENTS
-                WHERE GAME_ID = {GAME_ID}
-                AND EVENT_NAME = 'playedMiniGameStatus'
-                AND EVENT_JSON:MiniGameName::STRING = '{original_name}'
-                AND EVENT_TIMESTAMP >= '{mg_start_str}' AND EVENT_TIMESTAMP < '{mg_end_str}'
-                GROUP BY DATE(EVENT_TIMESTAMP)
-                ORDER BY SANA
-            """)
-
-        if not mg_stats.empty:
-            mg_stats["SANA"] = pd.to_datetime(mg_stats["SANA"])
-
-            # Shaded area
-            area = (
-                alt.Chart(mg_stats)
-                .mark_area(
-                    color=COLORS["minigame"],
-                    opacity=0.2,
-                    line=False
-                )
-                .encode(
-                    x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=5, labelFontWeight=600)),
-                    y=alt.Y("OYINLAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
-                )
-            )
-            
-            # Line
-            line = (
-                alt.Chart(mg_stats)
-                .mark_line(color=COLORS["minigame"], strokeWidth=2.6, opacity=0.9)
+            chart = (
+                alt.Chart(top_games)
+                .mark_bar(color=COLORS["purple"], cornerRadiusTopRight=8, cornerRadiusBottomRight=8, size=34, opacity=0.92)
                 .encode(
-                    x=alt.X("SANA:T", title="", axis=alt.Axis(format="%Y-%m-%d", labelAngle=-30, tickCount=10, labelFontWeight=600)),
-                    y=alt.Y("OYINLAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                    x=alt.X("OYINCHILAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
+                    y=alt.Y("NOMI:N", title="", sort="-x", axis=alt.Axis(labelFontWeight=600)),
                     tooltip=[
-                        alt.Tooltip("SANA:T", title="Sana", format="%Y-%m-%d"),
-                        alt.Tooltip("OYINLAR:Q", title="O'yinlar", format=","),
+                        alt.Tooltip("NOMI:N", title="O'yin"),
+                        alt.Tooltip("OYINCHILAR:Q", title="O'yinchilar", format=","),
+                        alt.Tooltip("OYINLAR:Q", title="O'ynalishlar", format=","),
+                        alt.Tooltip("OYIN_PER_OYINCHI:Q", title="O'yin / o'yinchi", format=".1f"),
+                        alt.Tooltip("P50:Q", title="O'yinchi boshiga p50", format=".1f"),
+                        alt.Tooltip("P90:Q", title="O'yinchi boshiga p90", format=".1f"),
                     ],
                 )
+                .properties(height=290, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
             )
-            
-            # Points
-            points = (
-                alt.Chart(mg_stats)
-                .mark_circle(size=60, color=COLORS["minigame"], opacity=0.85)
-                .encode(x="SANA:T", y="OYINLAR:Q")
-            )
-
-            st.altair_chart((area + line + points).properties(height=320, padding={"top": 18, "left": 8, "right": 8, "bottom": 8}), width="stretch")
+            st.altair_chart(chart, width="stretch")
         else:
-            st.info("Tanlangan davr uchun ma'lumotlar mavjud emas")
+            st.info("Ma'lumotlar mavjud emas")
     except Exception as e:
-        st.error(f"Mini oyinlar trendi xatolik: {e}")
+        st.error(f"TOP 5 mini o'yin xatolik: {e}")
 
 
-# ----------------------------
-# 7) Top 5 mini-games
-# ----------------------------
-st.markdown(
-    """
+    # ----------------------------
+    # 8) Mini-game funnel
+    # ----------------------------
+    st.markdown(
+        """
 <div class="sec-row">
   <div>
-    <div class="sec-title">🏆 TOP 5 mini o'yin</div>
-    <div class="sec-sub">Eng ko'p o'ynalganlar</div>
+    <div class="sec-title">🧩 Mini o'yinlar voronkasi</div>
+    <div class="sec-sub">Mini o'yinlar trendi davrida boshlangan, tugatilgan va tashlab ketilgan o'yinlar</div>
   </div>
   <div></div>
 </div>
 """,
-    unsafe_allow_html=True,
-)
-
-try:
-    top_games = run_query(f"""
-        SELECT
-            EVENT_JSON:MiniGameName::STRING as MINI_GAME,
-            COUNT(*) as OYINLAR
-        FROM {DB}.ACCOUNT_EVENTS
-        WHERE GAME_ID = {GAME_ID} AND EVENT_NAME = 'playedMiniGameStatus'
-        AND EVENT_JSON:MiniGameName::STRING IS NOT NULL
-        GROUP BY EVENT_JSON:MiniGameName::STRING
-        ORDER BY OYINLAR DESC
-        LIMIT 5
-    """)
-
-    if not top_games.empty:
-        top_games["NOMI"] = top_games["MINI_GAME"].apply(get_minigame_name)
-        medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
-
-        # Build all rows as single HTML block
-        rows_html = ""
-        for i, row in top_games.reset_index(drop=True).iterrows():
-            medal = medals[i] if i < len(medals) else f"#{i+1}"
-            rows_html += f'''
-<div class="rank-row">
-  <div class="rank-badge">{medal}</div>
-  <div class="rank-name">{row["NOMI"]}</div>
-  <div class="rank-val">{int(row["OYINLAR"]):,}</div>
-</div>'''
+        unsafe_allow_html=True,
+    )
 
-        st.markdown(f'<div class="rank-card card" style="margin-bottom: 16px;">{rows_html}</div>', unsafe_allow_html=True)
-
-        chart = (
-            alt.Chart(top_games)
-            .mark_bar(color=COLORS["purple"], cornerRadiusTopRight=8, cornerRadiusBottomRight=8, size=34, opacity=0.92)
-            .encode(
-                x=alt.X("OYINLAR:Q", title="", axis=alt.Axis(labelFontWeight=600)),
-                y=alt.Y("NOMI:N", title="", sort="-x", axis=alt.Axis(labelFontWeight=600)),
-                tooltip=[
-                    alt.Tooltip("NOMI:N", title="O'yin"),
-                    alt.Tooltip("OYINLAR:Q", title="O'ynalishlar", format=","),
-                ],
-            )
-            .properties(height=290, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
-        )
-        st.altair_chart(chart, width="stretch")
-    else:
-        st.info("Ma'lumotlar mavjud emas")
-except Exception as e:
-    st.error(f"TOP 5 mini o'yin xatolik: {e}")
+    if len(mg_date_range) == 2:
+        try:
+            funnel_df = section_results["mg_funnel"].result()
+            show_as_of(funnel_df)
+
+            if not funnel_df.empty:
+                starts = int(funnel_df["BOSHLANGAN"].sum())
+                completions = int(funnel_df["TUGATILGAN"].sum())
+                f1, f2, f3 = st.columns(3)
+                f1.metric("Boshlangan", f"{starts:,}")
+                f2.metric("Tugatilgan", f"{completions:,}")
+                f3.metric("Konversiya", f"{completions * 100 / starts:.1f}%" if starts else "N/A")
+
+                funnel_df["NOMI"] = funnel_df["MINI_GAME"].apply(get_minigame_name)
+                funnel_long = funnel_df.melt(
+                    id_vars=["NOMI", "KONVERSIYA", "MEDIAN_SEKUND"],
+                    value_vars=["TUGATILGAN", "TASHLANGAN"],
+                    var_name="HOLAT",
+                    value_name="OYINLAR",
+                )
+                funnel_long["HOLAT"] = funnel_long["HOLAT"].map({"TUGATILGAN": "Tugatilgan", "TASHLANGAN": "Tashlab ketilgan"})
+
+                chart = (
+                    alt.Chart(funnel_long)
+                    .mark_bar(cornerRadiusTopRight=6, cornerRadiusBottomRight=6, size=26, opacity=0.92)
+                    .encode(
+                        x=alt.X("OYINLAR:Q", title="", stack="zero", axis=alt.Axis(labelFontWeight=600)),
+                        y=alt.Y("NOMI:N", title="", sort=funnel_df["NOMI"].tolist(), axis=alt.Axis(labelFontWeight=600)),
+                        color=alt.Color(
+                            "HOLAT:N",
+                            title="",
+                            scale=alt.Scale(domain=["Tugatilgan", "Tashlab ketilgan"], range=[COLORS["android"], COLORS["other"]]),
+                            legend=alt.Legend(orient="top"),
+                        ),
+                        tooltip=[
+                            alt.Tooltip("NOMI:N", title="O'yin"),
+                            alt.Tooltip("HOLAT:N", title="Holat"),
+                            alt.Tooltip("OYINLAR:Q", title="O'yinlar", format=","),
+                            alt.Tooltip("KONVERSIYA:Q", title="Konversiya, %", format=".1f"),
+                            alt.Tooltip("MEDIAN_SEKUND:Q", title="Median tugatish vaqti (sek)", format=",.0f"),
+                        ],
+                    )
+                    .properties(height=max(220, 42 * len(funnel_df)), padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
+                )
+                st.altair_chart(chart, width="stretch")
+            else:
+                st.info("Tanlangan davr uchun ma'lumotlar mavjud emas")
+        except Exception as e:
+            st.error(f"Mini o'yinlar voronkasi xatolik: {e}")
 
 
-# ----------------------------
-# 8) Retention
-# ----------------------------
-st.markdown(
-    """
+    # ----------------------------
+    # 9) Retention
+    # ----------------------------
+    st.markdown(
+        """
 <div class="sec-row">
   <div>
     <div class="sec-title">🔄 Saqlanib qolish darajasi</div>
@@ -1839,79 +3763,105 @@ st.markdown(
   <div></div>
 </div>
 """,
-    unsafe_allow_html=True,
-)
+        unsafe_allow_html=True,
+    )
 
-c1, c2, c3 = st.columns(3)
+    c1, c2, c3 = st.columns(3)
 
-try:
-    d1 = run_query(f"""
-        WITH first_day AS (
-            SELECT USER_ID, MIN(EVENT_DATE) as first_date
-            FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-            WHERE GAME_ID = {GAME_ID}
-            GROUP BY USER_ID
-        ),
-        returned AS (
-            SELECT f.USER_ID
-            FROM first_day f
-            JOIN {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY s
-              ON f.USER_ID = s.USER_ID
-             AND s.EVENT_DATE = DATEADD(day, 1, f.first_date)
-             AND s.GAME_ID = {GAME_ID}
-        )
-        SELECT ROUND(COUNT(DISTINCT r.USER_ID) * 100.0 / NULLIF(COUNT(DISTINCT f.USER_ID), 0), 1) as RET
-        FROM first_day f
-        LEFT JOIN returned r ON f.USER_ID = r.USER_ID
-    """)
-    c1.metric("1-kun", f"{float(d1['RET'][0] or 0.0)}%")
-except Exception:
-    c1.metric("1-kun", "N/A")
+    try:
+        ret_df = section_results["retention"].result().set_index("KUN")
+        show_as_of(ret_df)
+    except Exception:
+        ret_df = None
+    for col, ret_day in zip((c1, c2, c3), RETENTION_DAYS):
+        if ret_df is None:
+            col.metric(f"{ret_day}-kun", "N/A")
+        elif pd.isna(ret_df.at[ret_day, "RET"]):
+            col.metric(f"{ret_day}-kun", "N/A", help=f"Hali {ret_day} kun o'tgan kogorta yo'q")
+        else:
+            col.metric(
+                f"{ret_day}-kun",
+                f"{float(ret_df.at[ret_day, 'RET'])}%",
+                help=f"{int(ret_df.at[ret_day, 'USERS']):,} foydalanuvchi asosida",
+            )
 
-try:
-    d7 = run_query(f"""
-        WITH first_day AS (
-            SELECT USER_ID, MIN(EVENT_DATE) as first_date
-            FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-            WHERE GAME_ID = {GAME_ID}
-            GROUP BY USER_ID
-        ),
-        returned AS (
-            SELECT f.USER_ID
-            FROM first_day f
-            JOIN {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY s
-              ON f.USER_ID = s.USER_ID
-             AND s.EVENT_DATE = DATEADD(day, 7, f.first_date)
-             AND s.GAME_ID = {GAME_ID}
-        )
-        SELECT ROUND(COUNT(DISTINCT r.USER_ID) * 100.0 / NULLIF(COUNT(DISTINCT f.USER_ID), 0), 1) as RET
-        FROM first_day f
-        LEFT JOIN returned r ON f.USER_ID = r.USER_ID
-    """)
-    c2.metric("7-kun", f"{float(d7['RET'][0] or 0.0)}%")
-except Exception:
-    c2.metric("7-kun", "N/A")
+    # Cohort heatmap: first-seen day/week x days (weeks) since
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('<div class="sec-sub">Kogortalar bo\'yicha saqlanib qolish, %</div>', unsafe_allow_html=True)
+    with right:
+        retention_grain = st.selectbox("Kogorta", list(RETENTION_GRAINS), key="retention_grain")
 
-try:
-    d30 = run_query(f"""
-        WITH first_day AS (
-            SELECT USER_ID, MIN(EVENT_DATE) as first_date
-            FROM {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY
-            WHERE GAME_ID = {GAME_ID}
-            GROUP BY USER_ID
-        ),
-        returned AS (
-            SELECT f.USER_ID
-            FROM first_day f
-            JOIN {DB}.ACCOUNT_FACT_USER_SESSIONS_DAY s
-              ON f.USER_ID = s.USER_ID
-             AND s.EVENT_DATE = DATEADD(day, 30, f.first_date)
-             AND s.GAME_ID = {GAME_ID}
-        )
-        SELECT ROUND(COUNT(DISTINCT r.USER_ID) * 100.0 / NULLIF(COUNT(DISTINCT f.USER_ID), 0), 1) as RET
-        FROM first_day f
-        LEFT JOIN returned r ON f.USER_ID = r.USER_ID
-    """)
-    c3.metric("30-kun", f"{float(d30['RET'][0] or 0.0)}%")
-except Exception:
-    c3.metric("30-kun", "N/A")
+    try:
+        matrix_df = section_results["retention_matrix"].result()
+        show_as_of(matrix_df)
+
+        if not matrix_df.empty:
+            offset_title = "Kun" if retention_grain == "Kunlik" else "Hafta"
+            heatmap = (
+                alt.Chart(matrix_df)
+                .mark_rect(cornerRadius=3)
+                .encode(
+                    x=alt.X("KUN:O", title=offset_title, axis=alt.Axis(labelAngle=0, labelFontWeight=600)),
+                    y=alt.Y("KOHORTA:O", title="", sort="descending", axis=alt.Axis(labelFontWeight=600)),
+                    color=alt.Color("RET:Q", scale=alt.Scale(scheme="blues", domain=[0, 100]), legend=None),
+                    tooltip=[
+                        alt.Tooltip("KOHORTA:O", title="Kogorta"),
+                        alt.Tooltip("KUN:O", title=offset_title),
+                        alt.Tooltip("USERS:Q", title="Foydalanuvchilar", format=","),
+                        alt.Tooltip("RET:Q", title="Saqlanish, %", format=".1f"),
+                    ],
+                )
+                .properties(height=max(220, 18 * matrix_df["KOHORTA"].nunique()), padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
+            )
+            st.altair_chart(heatmap, width="stretch")
+        else:
+            st.info("Ma'lumotlar mavjud emas")
+    except Exception as e:
+        st.error(f"Kogortalar jadvali xatolik: {e}")
+
+
+    # ----------------------------
+    # 10) Weekday x hour heatmap
+    # ----------------------------
+    left, right = st.columns([1.35, 1], gap="large", vertical_alignment="bottom")
+    with left:
+        st.markdown('''<div class="sec-title">🗓️ Haftalik faollik xaritasi</div><div class="sec-sub">Hafta kuni va soat bo'yicha o'rtacha faollik (UTC+5)</div>''', unsafe_allow_html=True)
+    with right:
+        h1, h2 = st.columns([1.2, 1], gap="small")
+        with h1:
+            heatmap_date_range = st.date_input("Davr", value=HEATMAP_DEFAULT_RANGE, key="heatmap_date")
+        with h2:
+            heatmap_metric = st.selectbox("Ko'rsatkich", ["Hodisalar", "Faol foydalanuvchilar"], key="heatmap_metric")
+
+    if len(heatmap_date_range) == 2:
+        try:
+            heatmap_df = section_results["heatmap"].result()
+            show_as_of(heatmap_df)
+
+            if heatmap_df["HODISALAR"].sum() > 0:
+                value = "HODISALAR" if heatmap_metric == "Hodisalar" else "FOYDALANUVCHILAR"
+                heatmap = (
+                    alt.Chart(heatmap_df)
+                    .mark_rect(cornerRadius=3)
+                    .encode(
+                        x=alt.X("SOAT_LABEL:O", title="", sort=None, axis=alt.Axis(labelAngle=-45, labelFontWeight=600)),
+                        y=alt.Y("KUN:O", title="", sort=WEEKDAYS, axis=alt.Axis(labelFontWeight=600)),
+                        color=alt.Color(f"{value}:Q", scale=alt.Scale(scheme="blues"), legend=None),
+                        tooltip=[
+                            alt.Tooltip("KUN:O", title="Kun"),
+                            alt.Tooltip("SOAT_LABEL:O", title="Soat"),
+                            alt.Tooltip("HODISALAR:Q", title="Hodisalar (o'rtacha)", format=",.1f"),
+                            alt.Tooltip("FOYDALANUVCHILAR:Q", title="Faol foydalanuvchilar (o'rtacha)", format=",.1f"),
+                        ],
+                    )
+                    .properties(height=260, padding={"top": 18, "left": 8, "right": 8, "bottom": 8})
+                )
+                st.altair_chart(heatmap, width="stretch")
+            else:
+                st.info("Tanlangan davr uchun ma'lumotlar mavjud emas")
+        except Exception as e:
+            st.error(f"Faollik xaritasi xatolik: {e}")
+
+finally:
+    end_script_run(script_run)